@@ -0,0 +1,304 @@
+# Offline benchmarks for the crawler, run against the fixture pages in
+# bench/fixtures served by the stand-in in bench/server.py:
+#
+#   python bench/run.py                    compare against bench/baselines.json
+#   python bench/run.py --save-baseline    record this machine's numbers
+#   python bench/run.py --quick            fewer repeats
+#
+# Every number is the median of several samples. Short operations are run in a
+# loop until a sample takes at least min_sample_seconds, so timer resolution
+# and one-off stalls of a busy machine do not decide the result.
+#
+# The run first checks that the fixtures still parse to bench/fixtures/expected.json,
+# then measures parse cost per page, page cost through get_series_info and
+# get_books_info, end-to-end series throughput with both engines (also with
+# injected 500s and 429s) and export time at 100/1000 books. It exits with
+# status 1 when extraction changed or a number is worse than the baseline by
+# more than --tolerance.
+import argparse
+import contextlib
+import gc
+import io
+import json
+import math
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(bench_dir))
+
+import main
+from server import FixturePages, book_asin, series_path, start_server
+
+expected_path = os.path.join(bench_dir, 'fixtures', 'expected.json')
+baselines_path = os.path.join(bench_dir, 'baselines.json')
+search_query = 'ベンチマーク・シリーズ'
+min_sample_seconds = 0.2
+
+# Settings for every crawl: no rate limit, and nothing remembered between runs
+bench_config = {
+    "max_requests_per_second": 0,
+    "cache_enabled": False,
+    "incremental_refresh": False,
+    "catalog_enabled": False,
+    "title_index_min_score": 2,
+    "download_images": False,
+    "metrics_path": "",
+    "metrics_prometheus_path": ""
+}
+
+def crawl_config(base_url, **overrides):
+    config = dict(main.default_config, **bench_config)
+    config.update(overrides, baseurl=base_url)
+    return config
+
+@contextlib.contextmanager
+def quiet():
+    # The crawler logs every page and book; keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def median_time(function, repeat):
+    # Median seconds per call over repeat samples. A sample calls the function
+    # as often as it takes to fill min_sample_seconds, so sub-millisecond cases
+    # are not at the mercy of the timer. As in timeit, garbage collection is
+    # paused while timing.
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with quiet():
+            start = time.perf_counter()
+            function()
+            first = time.perf_counter() - start
+            number = max(1, math.ceil(min_sample_seconds / max(first, 1e-6)))
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for _ in range(number):
+                    function()
+                samples.append((time.perf_counter() - start) / number)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return statistics.median(samples)
+
+def extraction_results(pages):
+    # Everything the parsers take from the fixtures, in a JSON-comparable form
+    def sorted_people(book_info):
+        return dict(book_info, Authors=sorted(book_info.get('Authors', [])), Illustrators=sorted(book_info.get('Illustrators', [])))
+
+    series_info, total_books = main.parse_series_page(pages.series_page(1))
+    return {
+        'search': main.parse_search_results(pages.search(search_query), 'http://127.0.0.1'),
+        'series': dict(series_info, total_books=total_books),
+        'series_page_2': main.parse_series_page_asins(pages.series_page(2)),
+        'product': sorted_people(main.parse_book_page(pages.product(1), book_asin(1))),
+        'product_zh': sorted_people(main.parse_book_page(pages.product(1, '_zh'), book_asin(1))),
+        'product_no_illustrator': sorted_people(main.parse_book_page(pages.product(7), book_asin(7)))
+    }
+
+def check_extraction(update):
+    # Compare what the parsers extract with the recorded expectation
+    results = json.loads(json.dumps(extraction_results(FixturePages(23))))
+    if update or not os.path.exists(expected_path):
+        with open(expected_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        print(f"Wrote {expected_path}")
+        return True
+    with open(expected_path, 'r', encoding='utf-8') as f:
+        expected = json.load(f)
+    changed = [name for name in expected if results.get(name) != expected[name]]
+    for name in changed:
+        print(f"Extraction changed for {name}:")
+        print(f"  expected {json.dumps(expected[name], ensure_ascii=False)}")
+        print(f"  got      {json.dumps(results.get(name), ensure_ascii=False)}")
+    return not changed
+
+def bench_parse(repeat):
+    # Parse cost per page straight from memory, in milliseconds
+    pages = FixturePages(100)
+    search_page, series_page, series_page_2 = pages.search(search_query), pages.series_page(1), pages.series_page(2)
+    product_page, product_zh_page = pages.product(1), pages.product(1, '_zh')
+    cases = [
+        ('parse_search_ms', lambda: main.parse_search_results(search_page, 'http://127.0.0.1')),
+        ('parse_series_ms', lambda: main.parse_series_page(series_page)),
+        ('parse_series_page_asins_ms', lambda: main.parse_series_page_asins(series_page_2)),
+        ('parse_product_ms', lambda: main.parse_book_page(product_page, book_asin(1))),
+        ('parse_product_zh_ms', lambda: main.parse_book_page(product_zh_page, book_asin(1)))
+    ]
+    return {name: median_time(function, repeat) * 1000 for name, function in cases}
+
+def bench_page_fetch(repeat, books):
+    # Cost per page including the local HTTP round trip, with no added latency
+    server = start_server(books=books)
+    try:
+        config = crawl_config(server.base_url)
+        series_url = server.base_url + series_path
+        series_pages = main.series_page_count(books)
+        with quiet():
+            session = main.create_session(config)
+        try:
+            series_seconds = median_time(lambda: main.get_series_info(series_url, server.base_url, session, max_workers=4), repeat)
+            book_seconds = median_time(lambda: [main.get_books_info(server.base_url, book_asin(number), session=session)
+                                              for number in range(1, 21)], repeat)
+        finally:
+            session.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    return {
+        'get_series_info_ms_per_page': series_seconds * 1000 / series_pages,
+        'get_books_info_ms_per_book': book_seconds * 1000 / 20
+    }
+
+def crawl_once(engine_name, books, latency, error_rate=0.0, throttle_rate=0.0):
+    # One search-to-last-book crawl of the series; returns complete books per
+    # second and how many books came back complete
+    server = start_server(books=books, latency=latency, error_rate=error_rate, throttle_rate=throttle_rate)
+    try:
+        config = crawl_config(server.base_url, engine=engine_name)
+        with quiet():
+            engine = main.create_crawl_engine(config, engine_name)
+            try:
+                start = time.perf_counter()
+                series_link = engine.find_series_link(server.base_url, search_query)
+                series_info, books_info_list = main.crawl_series(engine, config, series_link, log_books=False)
+                elapsed = time.perf_counter() - start
+            finally:
+                engine.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    complete = sum(1 for book_info in books_info_list or [] if book_info and book_info.get('Title') and book_info.get('Authors'))
+    return complete / elapsed, complete
+
+def bench_throughput(books, latency, repeat):
+    # Median of several crawls per engine, without and with injected faults.
+    # The engines take turns so that a slow stretch of the machine does not
+    # land on one engine only.
+    results = {}
+    for label, faults in (('', {}), ('_faults', {'error_rate': 0.03, 'throttle_rate': 0.03})):
+        runs = {'sync': [], 'async': []}
+        for _ in range(repeat):
+            for engine_name in runs:
+                runs[engine_name].append(crawl_once(engine_name, books, latency, **faults))
+        for engine_name in runs:
+            results[f"{engine_name}{label}_books_per_s"] = statistics.median([books_per_second for books_per_second, _ in runs[engine_name]])
+            complete = min(complete for _, complete in runs[engine_name])
+            if complete != books:
+                print(f"Warning: the {engine_name} engine returned {complete} of {books} books complete{' with faults' if faults else ''}.")
+    return results
+
+def synthetic_books(count):
+    pages = FixturePages(min(count, 999), page_kb=0)
+    book_info = main.parse_book_page(pages.product(1), book_asin(1))
+    return [book_info.copy({'Title': f"{book_info.title} {number}"}) for number in range(1, count + 1)]
+
+def bench_export(repeat):
+    # Time to render and write the HTML export, in milliseconds. A 10-book
+    # export takes well under a millisecond, too little to time reliably.
+    series_info = main.parse_series_page(FixturePages(23, page_kb=0).series_page(1))[0]
+    results = {}
+    for count in (100, 1000):
+        books_info_list = synthetic_books(count)
+        results[f"export_{count}_books_ms"] = median_time(
+            lambda: main.export_to_html(series_info, books_info_list, 'http://127.0.0.1'), repeat) * 1000
+    return results
+
+def benchmark_groups(quick):
+    # The same series either way, so --quick numbers compare with the baseline
+    repeat = 5 if quick else 11
+    books = 100
+    return [
+        ("Measuring parse cost...", lambda: bench_parse(repeat)),
+        ("Measuring page cost through get_series_info and get_books_info...", lambda: bench_page_fetch(repeat, books)),
+        (f"Crawling a {books}-book series with 20 ms latency...", lambda: bench_throughput(books, 0.02, 3 if quick else 7)),
+        ("Measuring export time...", lambda: bench_export(repeat))
+    ]
+
+def higher_is_better(name):
+    return name.endswith('_per_s')
+
+def better_value(name, first, second):
+    return max(first, second) if higher_is_better(name) else min(first, second)
+
+def slowdown(name, value, baseline):
+    change = value / baseline - 1
+    return -change if higher_is_better(name) else change
+
+def run_benchmarks(groups, baselines, tolerance):
+    # Timings on a busy machine vary; a group that looks slower than its
+    # baseline is measured once more and keeps the better of the two medians
+    results = {}
+    for message, function in groups:
+        print(message)
+        group_results = function()
+        if any(baselines.get(name) and slowdown(name, value, baselines[name]) > tolerance for name, value in group_results.items()):
+            print("Measuring again to confirm a slowdown...")
+            for name, value in function().items():
+                group_results[name] = better_value(name, group_results[name], value)
+        results.update(group_results)
+    return results
+
+def compare(results, baselines, tolerance):
+    # Print every number next to its baseline; returns the regressed names
+    regressions = []
+    print(f"\n{'benchmark':<36}{'result':>12}{'baseline':>12}{'change':>9}")
+    for name, value in results.items():
+        baseline = baselines.get(name)
+        if not baseline:
+            print(f"{name:<36}{value:>12.2f}{'-':>12}")
+            continue
+        flag = '  REGRESSION' if slowdown(name, value, baseline) > tolerance else ''
+        if flag:
+            regressions.append(name)
+        print(f"{name:<36}{value:>12.2f}{baseline:>12.2f}{value / baseline - 1:>+9.0%}{flag}")
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline crawler benchmarks")
+    parser.add_argument('--save-baseline', action='store_true', help="store this run's numbers as the baseline")
+    parser.add_argument('--update-expected', action='store_true', help="accept the current extraction results")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown before a number counts as a regression")
+    parser.add_argument('--quick', action='store_true', help="fewer repeats")
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(baselines_path) and not args.save_baseline:
+        with open(baselines_path, 'r', encoding='utf-8') as f:
+            baselines = json.load(f).get('results', {})
+
+    work_dir = tempfile.mkdtemp(prefix='bench-')
+    os.chdir(work_dir)
+    try:
+        with open('config.json', 'w', encoding='utf-8') as f:
+            json.dump(crawl_config(''), f)
+        main.page_parser.configure(main.default_config['parser'])
+
+        extraction_ok = check_extraction(args.update_expected)
+        print("Extraction matches the fixtures." if extraction_ok else "Extraction does not match the fixtures.")
+        results = run_benchmarks(benchmark_groups(args.quick), baselines, args.tolerance)
+    finally:
+        os.chdir(bench_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    regressions = compare(results, baselines, args.tolerance)
+
+    if args.save_baseline:
+        with open(baselines_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'machine': f"{platform.platform()} / Python {platform.python_version()} / {main.page_parser.backend}",
+                'results': {name: round(value, 3) for name, value in results.items()}
+            }, f, indent=2)
+            f.write('\n')
+        print(f"\nSaved the baseline to {baselines_path}")
+    elif regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+
+    sys.exit(0 if extraction_ok and (args.save_baseline or not regressions) else 1)
@@ -0,0 +1,174 @@
+# Local stand-in for the store, serving the recorded pages in bench/fixtures
+# for a series of any length: search results, the series pages (ten books a
+# page) and every book's /dp/ and /zh/dp/ product page. Latency, server
+# errors and 429 throttling can be injected so crawls can be measured offline.
+#
+#   python bench/server.py --port 8800 --books 100 --latency 0.05 --throttle-rate 0.02
+#
+# then point "baseurl" at http://127.0.0.1:8800 and search for ベンチマーク・シリーズ.
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+series_path = '/dp/SERIESBENCH'
+books_per_series_page = 10
+# 1x1 transparent GIF for cover requests
+blank_image = bytes.fromhex('47494638396101000100800000000000ffffff21f90401000000002c00000000010001000002024401003b')
+
+def load_fixture(name):
+    with open(os.path.join(fixtures_dir, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+def book_asin(number):
+    return f"B0BENCH{number:03d}"
+
+def book_number(asin):
+    return int(asin[-3:])
+
+def padding(page_kb):
+    # Real pages carry hundreds of KB of scripts before the content and
+    # recommendation widgets after it; the split is roughly 40/60
+    head = 'window.ue_csm=window;(function(d){var e=d.createElement("script");e.async=1;})(document);\n'
+    tail = ('<div class="a-carousel-card"><a class="a-link-normal" href="/dp/B0RELATED1"><img alt="" src="/img/related.jpg">'
+            '<span class="a-truncate-full">関連商品のタイトル</span></a><span class="a-price">￥693</span></div>\n')
+    head_bytes = page_kb * 1024 * 2 // 5
+    tail_bytes = page_kb * 1024 - head_bytes
+    return head * (head_bytes // len(head.encode('utf-8')) + 1), tail * (tail_bytes // len(tail.encode('utf-8')) + 1)
+
+class FixturePages(object):
+    # Renders the fixture templates. Image URLs point at image_base.
+    def __init__(self, total_books, page_kb=300, image_base='https://m.media-amazon.com/images'):
+        self.total_books = total_books
+        self.image_base = image_base
+        self.head_padding, self.tail_padding = padding(page_kb)
+        self.templates = {name: load_fixture(f"{name}.html") for name in
+                          ('search', 'series', 'series_item', 'product', 'product_illustrator', 'product_zh', 'product_zh_illustrator')}
+
+    def fill(self, template, **values):
+        values = dict(values, IMG=self.image_base, HEAD_PADDING=self.head_padding, TAIL_PADDING=self.tail_padding)
+        for key, value in values.items():
+            template = template.replace(f"__{key}__", str(value))
+        return template
+
+    def search(self, query):
+        return self.fill(self.templates['search'], QUERY=query)
+
+    def series_page(self, page_number):
+        first = (page_number - 1) * books_per_series_page + 1
+        last = min(first + books_per_series_page - 1, self.total_books)
+        items = ''.join(
+            self.fill(self.templates['series_item'], POSITION=number - 1, ASIN=book_asin(number), N=number)
+            for number in range(first, last + 1))
+        return self.fill(self.templates['series'], TOTAL=self.total_books, ITEMS=items)
+
+    def product(self, number, variant=''):
+        # Every seventh book has no illustrator, as some real volumes do
+        illustrator = '' if number % 7 == 0 else self.templates[f"product{variant}_illustrator"]
+        return self.fill(self.templates[f"product{variant}"], ILLUSTRATOR=illustrator, ASIN=book_asin(number), N=number,
+                         MONTH=(number - 1) % 12 + 1, DAY=(number - 1) % 28 + 1)
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type='text/html; charset=utf-8', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            server.requests += 1
+            roll = server.random.random()
+        if roll < server.throttle_rate:
+            server.count('throttled')
+            return self.send_body(429, b'', headers={'Retry-After': '1'})
+        if roll < server.throttle_rate + server.error_rate:
+            server.count('errors')
+            return self.send_body(500, b'<html><body>Internal Server Error</body></html>')
+
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        pages = server.pages
+        if url.path == '/s':
+            body = pages.search(query.get('k', [''])[0])
+        elif url.path == series_path:
+            page_number = int(query.get('pageNumber', ['1'])[0])
+            body = pages.series_page(page_number)
+        elif url.path.startswith(('/dp/B0BENCH', '/zh/dp/B0BENCH')):
+            number = book_number(url.path.rstrip('/').rsplit('/', 1)[1])
+            if not 1 <= number <= pages.total_books:
+                return self.send_body(404, b'')
+            body = pages.product(number, '_zh' if url.path.startswith('/zh/') else '')
+        elif url.path.startswith('/img/'):
+            return self.send_body(200, blank_image, 'image/gif')
+        else:
+            return self.send_body(404, b'')
+        self.send_body(200, body.encode('utf-8'))
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The async engine opens dozens of connections at once
+    request_queue_size = 128
+
+    def __init__(self, port=0, books=100, latency=0.0, error_rate=0.0, throttle_rate=0.0, page_kb=300, seed=1):
+        super().__init__(('127.0.0.1', port), StandInHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.pages = FixturePages(books, page_kb, f"http://127.0.0.1:{self.server_address[1]}/img")
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.counts = {}
+
+    def handle_error(self, request, client_address):
+        # Streaming clients hang up once they have what they need
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+def start_server(**options):
+    # A running stand-in on a free port, served from a background thread
+    server = StandInServer(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stand-in store serving the benchmark fixtures")
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--books', type=int, default=100, help="books in the series (at most 999)")
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds added to every response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests answered with 500")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="share of requests answered with 429 and Retry-After")
+    parser.add_argument('--page-kb', type=int, default=300, help="approximate size of each page")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    server = StandInServer(args.port, args.books, args.latency, args.error_rate, args.throttle_rate, args.page_kb, args.seed)
+    print(f"Serving a {args.books}-book series at {server.base_url} (search for ベンチマーク・シリーズ).")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
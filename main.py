@@ -1,5 +1,7 @@
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from bs4 import BeautifulSoup, SoupStrainer
 import urllib.parse
 import os
 import json
@@ -7,27 +9,151 @@ import difflib
 import re
 import math
 import time
-from tkinter import Tk, Label, Entry, Button, StringVar, END, Text, Scrollbar, RIGHT, Y, BOTH, LEFT, Frame, ttk, X
-from tkinter import messagebox
 from jinja2 import Environment
 import random
 import sys
 import threading
+import queue
+import heapq
+import io
+import signal
+import contextlib
+import asyncio
+import argparse
+import functools
+import sqlite3
+import zlib
+import hashlib
+import socket
+import codecs
+import unicodedata
+import inspect
+from html.parser import HTMLParser
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-def generate_config():
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None  # The async engine falls back to the requests session in threads
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None  # Thumbnails fall back to the site's small cover images
+
+try:
+    import lxml  # noqa: F401 (only needed as a BeautifulSoup backend)
+    lxml_available = True
+except ImportError:
+    lxml_available = False
+
+# Defaults for every config.json key; missing keys fall back to these values
+default_config = {
+    "baseurl": "https://www.amazon.co.jp",
+    # Number of product pages fetched in parallel
+    "max_workers": 4,
+    # Upper bound on requests per second sent to a single host
+    "max_requests_per_second": 2.0,
+    # Rate a host starts at; it rises while the site answers quickly and
+    # drops on 429/503, timeouts or slow responses
+    "initial_requests_per_second": 1.0,
+    "min_requests_per_second": 0.2,
+    # Number of keep-alive connections kept open per host
+    "pool_size": 10,
+    "keep_alive": True,
+    # Seconds to wait for the server before giving up on a request
+    "request_timeout": 30,
+    # Extra headers sent with every request
+    "default_headers": {},
+    # Crawl engine: "sync" (thread pool) or "async" (asyncio event loop)
+    "engine": "sync",
+    # Requests kept in flight at once by the async engine
+    "async_concurrency": 50,
+    # Queries crawled at the same time in batch mode
+    "batch_concurrency": 4,
+    # Tries per book or series page before it is given up. A failed one is
+    # tried again after retry_base_seconds, doubling with every attempt up to
+    # retry_max_seconds. After crawl_deadline_seconds (0 for no limit) a
+    # series crawl starts no more fetches and ends with the books it has.
+    "retry_max_attempts": 5,
+    "retry_base_seconds": 1,
+    "retry_max_seconds": 60,
+    "crawl_deadline_seconds": 0,
+    # Lines kept in the GUI log; older lines are removed
+    "gui_log_lines": 5000,
+    # Complete book records kept in memory during a run, so a book met again
+    # (in another series or a repeated query) is not fetched twice
+    "book_store_size": 50000,
+    # Worker processes that parse pages; 0 parses in the crawl threads
+    "parse_workers": 0,
+    # SQLite catalog of every crawled series and book (query it with --find)
+    "catalog_enabled": True,
+    "catalog_path": "output/catalog.sqlite",
+    # Download covers into image_dir and show the local copies in the export
+    "download_images": False,
+    "image_dir": "output/images",
+    "image_workers": 8,
+    "image_requests_per_second": 10,
+    "thumbnail_width": 200,
+    # JSON run summary with p50/p95/p99 timings, and optionally the same
+    # numbers as a Prometheus text file; "" turns either off
+    "metrics_path": "output/metrics.json",
+    "metrics_prometheus_path": "",
+    # How similar a query must be to a catalog title (0 to 1) to skip the site
+    # search; set above 1 to always search
+    "title_index_min_score": 0.8,
+    # Job queue (--queue): seconds a worker may hold a job, attempts per job,
+    # and seconds to wait before retrying, multiplied by the attempt number
+    "queue_lease_seconds": 300,
+    "queue_max_attempts": 5,
+    "queue_retry_seconds": 60,
+    # Crawl service (--serve): local address of the JSON API and how many
+    # finished jobs it keeps
+    "service_host": "127.0.0.1",
+    "service_port": 8765,
+    "service_job_history": 1000,
+    # On-disk cache of fetched pages
+    "cache_enabled": True,
+    "cache_path": "cache/responses.sqlite",
+    # Seconds a cached page is used without asking the server again
+    "cache_ttl": {
+        "search": 3600,
+        "series": 86400,
+        "product": 604800,
+        "default": 3600
+    },
+    # The least recently used pages are evicted above this size
+    "cache_max_mb": 500,
+    # Remember what was crawled per series and only fetch new or outdated books
+    "incremental_refresh": True,
+    "manifest_dir": "manifests",
+    # Books fetched longer ago than this are fetched again
+    "manifest_stale_days": 30,
+    # HTML parser: "auto" (lxml when installed), "lxml" or "html.parser"
+    "parser": "auto",
+    # Stop downloading a product page once every field we extract has been received
+    "stream_product_pages": True,
+    "stream_chunk_size": 16384
+}
+
+def load_config():
     config_file = 'config.json'
 
     if not os.path.exists(config_file):
-        default_config = {
-            "baseurl": "https://www.amazon.co.jp"
-        }
         with open(config_file, 'w', encoding='utf-8') as f:
             json.dump(default_config, f, indent=4)
 
     with open(config_file, 'r', encoding='utf-8') as f:
         config = json.load(f)
 
-    return config.get("baseurl", "")
+    # Fill in any keys the user's config file does not define
+    merged_config = dict(default_config)
+    merged_config.update(config)
+    return merged_config
+
+def generate_config():
+    return load_config().get("baseurl", "")
 
 def remove_language_parameter(url):
     # Parse the URL
@@ -51,120 +177,1335 @@ user_agents_list = [
     # Add more user agents as needed
 ]
 
+class HostRateState(object):
+    # Token bucket and latency history of one host
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.paused_until = 0
+        self.latency_average = None
+        self.latency_samples = 0
+
+class AdaptiveRateController(object):
+    # Paces requests per host with a token bucket whose rate adapts (AIMD):
+    # every fast successful response raises the rate a little, up to
+    # max_requests_per_second, while 429/503 answers, timeouts, connection
+    # errors and latency spikes halve it. Every fetch path reserves its slot
+    # here and reports the outcome back.
+    def __init__(self, max_rate, initial_rate=None, min_rate=0.2, increase_step=None, decrease_factor=0.5, latency_spike_factor=3.0, burst=1):
+        self.max_rate = max_rate
+        self.initial_rate = min(initial_rate or max_rate, max_rate) if max_rate > 0 else 0
+        self.min_rate = min(min_rate, self.initial_rate) if max_rate > 0 else 0
+        # By default ten fast responses in a row climb from nothing to the maximum
+        self.increase_step = increase_step or max_rate / 10
+        self.decrease_factor = decrease_factor
+        self.latency_spike_factor = latency_spike_factor
+        self.burst = max(1, burst)
+        self.lock = threading.Lock()
+        self.hosts = {}
+        # (time, host, reason, new rate) of every backoff
+        self.backoff_events = []
+
+    def host_state(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostRateState(self.initial_rate, self.burst)
+        return state
+
+    def reserve(self, url):
+        # Take the host's next token and return how long to wait for it
+        if self.max_rate <= 0:
+            return 0
+        host = urllib.parse.urlparse(url).netloc
+        with self.lock:
+            state = self.host_state(host)
+            now = time.monotonic()
+            state.tokens = min(self.burst, state.tokens + (now - state.updated_at) * state.rate)
+            state.updated_at = now
+            state.tokens -= 1
+            delay = -state.tokens / state.rate if state.tokens < 0 else 0
+            return max(delay, state.paused_until - now)
+
+    def wait(self, url):
+        delay = self.reserve(url)
+        if delay > 0:
+            time.sleep(delay)
+
+    def record(self, url, status_code, latency, retry_after=None):
+        host = urllib.parse.urlparse(url).netloc
+        if status_code in (429, 503):
+            self.back_off(host, f"HTTP {status_code}", retry_after)
+            return
+        with self.lock:
+            state = self.host_state(host)
+            spike = (state.latency_samples >= 5 and latency > state.latency_average * self.latency_spike_factor)
+            # Exponentially weighted average of recent response times
+            if state.latency_average is None:
+                state.latency_average = latency
+            else:
+                state.latency_average = 0.8 * state.latency_average + 0.2 * latency
+            state.latency_samples += 1
+            if not spike and status_code < 500 and self.max_rate > 0:
+                state.rate = min(self.max_rate, state.rate + self.increase_step)
+        if spike:
+            self.back_off(host, 'latency', detail=f"latency spike ({latency:.1f}s)")
+
+    def record_error(self, url, reason):
+        self.back_off(urllib.parse.urlparse(url).netloc, reason)
+
+    def back_off(self, host, reason, retry_after=None, detail=None):
+        # reason labels the metric, so it comes from a fixed set; detail, such
+        # as the measured latency, only goes into the log
+        metrics.count('rate_backoffs', reason=reason)
+        if self.max_rate <= 0:
+            # Rate limiting is off, so there is nothing to slow down
+            return
+        with self.lock:
+            state = self.host_state(host)
+            state.rate = max(self.min_rate, state.rate * self.decrease_factor)
+            if retry_after:
+                state.paused_until = max(state.paused_until, time.monotonic() + retry_after)
+            self.backoff_events.append((time.time(), host, detail or reason, state.rate))
+        print(f"Slowing down requests to {host} to {state.rate:.2f}/s ({detail or reason}).")
+
+    def current_rate(self, host):
+        with self.lock:
+            state = self.hosts.get(host)
+            return state.rate if state else self.initial_rate
+
+    def print_stats(self):
+        if self.max_rate <= 0:
+            print("Rate control: off (max_requests_per_second is 0).")
+            return
+        with self.lock:
+            rates = ', '.join(f"{host} {state.rate:.2f}/s" for host, state in self.hosts.items())
+            backoffs = len(self.backoff_events)
+        if rates:
+            print(f"Rate control: {rates} (max {self.max_rate:.2f}/s), {backoffs} backoffs.")
+
+def parse_retry_after(value):
+    # Retry-After in seconds; the HTTP-date form is rare enough to ignore
+    if value and value.strip().isdigit():
+        return int(value.strip())
+    return None
+
+class Metrics(object):
+    # Counters and timing samples for one run: per-request phases, crawl
+    # stages, parse vs. extract, status codes, retries, cache results and
+    # bytes. Timings keep their exact count and sum, plus up to max_samples
+    # values (a uniform reservoir) for the percentiles.
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            # (name, labels) -> value
+            self.counters = {}
+            # (name, labels) -> [count, sum, max, samples]
+            self.timings = {}
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            timing = self.timings.get(key)
+            if timing is None:
+                timing = self.timings[key] = [0, 0.0, 0.0, []]
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+            if len(timing[3]) < self.max_samples:
+                timing[3].append(seconds)
+            else:
+                slot = random.randrange(timing[0])
+                if slot < self.max_samples:
+                    timing[3][slot] = seconds
+
+    def summary(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            timings = sorted((key, (count, total, largest, sorted(samples))) for key, (count, total, largest, samples) in self.timings.items())
+        return {
+            'started_at': self.started_at,
+            'duration_seconds': time.time() - self.started_at,
+            'counters': [dict(name=name, labels=dict(labels), value=value) for (name, labels), value in counters],
+            'timings': [
+                dict(name=name, labels=dict(labels), count=count, sum=total, mean=total / count, max=largest,
+                     p50=percentile(samples, 0.5), p95=percentile(samples, 0.95), p99=percentile(samples, 0.99))
+                for (name, labels), (count, total, largest, samples) in timings
+            ],
+        }
+
+    def prometheus_text(self):
+        # Prometheus text exposition format: timings as summaries in seconds
+        lines = []
+        summary = self.summary()
+        typed = set()
+        for counter in summary['counters']:
+            name = f"crawler_{counter['name']}_total"
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{prometheus_labels(counter['labels'])} {counter['value']}")
+        for timing in summary['timings']:
+            name = f"crawler_{timing['name']}_seconds"
+            if name not in typed:
+                lines.append(f"# TYPE {name} summary")
+                typed.add(name)
+            for quantile in ('0.5', '0.95', '0.99'):
+                value = timing['p' + quantile[2:].ljust(2, '0')]
+                lines.append(f"{name}{prometheus_labels(dict(timing['labels'], quantile=quantile))} {value:.6f}")
+            lines.append(f"{name}_sum{prometheus_labels(timing['labels'])} {timing['sum']:.6f}")
+            lines.append(f"{name}_count{prometheus_labels(timing['labels'])} {timing['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def print_stats(self):
+        stages = [timing for timing in self.summary()['timings'] if timing['name'] == 'stage']
+        if stages:
+            summary = ', '.join(f"{timing['labels']['stage']} p50 {timing['p50'] * 1000:.0f} ms / p95 {timing['p95'] * 1000:.0f} ms"
+                                for timing in stages)
+            print(f"Stages: {summary}.")
+
+    def write(self, json_path=None, prometheus_path=None):
+        for path, text in ((json_path, lambda: json.dumps(self.summary(), indent=1)), (prometheus_path, self.prometheus_text)):
+            if not path:
+                continue
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            # Replace the file in one step so a scraper never reads half of it
+            temp_path = path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(text())
+            os.replace(temp_path, path)
+            print(f"Metrics written to {path}")
+
+metrics = Metrics()
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))]
+
+def prometheus_labels(labels):
+    if not labels:
+        return ''
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for key, value in sorted(labels.items()))
+    return '{' + ','.join(escaped) + '}'
+
+def timed_stage(stage):
+    # Record how long each call of a crawl stage takes; works for coroutines
+    # and crawl flows too
+    def decorator(function):
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def flow_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return (yield from function(*args, **kwargs))
+                finally:
+                    metrics.observe('stage', time.perf_counter() - started, stage=stage)
+            return flow_wrapper
+
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    metrics.observe('stage', time.perf_counter() - started, stage=stage)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.observe('stage', time.perf_counter() - started, stage=stage)
+        return wrapper
+    return decorator
+
+class InFlightCall(object):
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight(object):
+    # Coalesces concurrent calls for the same key: the first caller runs the
+    # call and every caller that arrives while it is in flight waits for and
+    # shares its result (or exception). Keys start with their kind ('get',
+    # 'stream', 'series', 'book'), which the statistics are broken down by.
+    # do() is for threads; do_async() for coroutines on one event loop.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.async_calls = {}
+        self.coalesced = {}
+
+    def reset(self):
+        with self.lock:
+            self.coalesced = {}
+
+    def count(self, key):
+        with self.lock:
+            self.coalesced[key[0]] = self.coalesced.get(key[0], 0) + 1
+        metrics.count('coalesced_requests', kind=key[0])
+
+    def do(self, key, function):
+        # Returns (result, shared); shared is True when another caller's call was used
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = InFlightCall()
+        if not leader:
+            call.done.wait()
+            self.count(key)
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = function()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result, False
+
+    async def do_async(self, key, function):
+        # Like do(), for a function returning a coroutine
+        while key in self.async_calls:
+            future = self.async_calls[key]
+            try:
+                result = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    # The caller running it was stopped; run it here instead
+                    continue
+                raise
+            self.count(key)
+            return result, True
+        future = self.async_calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await function()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody may be waiting; do not warn about an unretrieved exception
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self.async_calls[key]
+
+    def print_stats(self):
+        with self.lock:
+            coalesced = dict(self.coalesced)
+        if coalesced:
+            kinds = ', '.join(f"{kind} {count}" for kind, count in sorted(coalesced.items()))
+            print(f"Coalesced: {sum(coalesced.values())} fetches shared one already in flight ({kinds}).")
+
+class BookStore(object):
+    # Complete book records collected during a run, so a book listed in
+    # several series or queried twice in one batch is fetched once. ASINs are
+    # stored as base-36 integers, which take less memory than strings, and
+    # the oldest records are dropped beyond max_books. `seen` keeps the key of
+    # every book ever stored, to count fetches a larger store would have saved.
+    def __init__(self, max_books=50000):
+        self.lock = threading.Lock()
+        self.reset(max_books)
+
+    def reset(self, max_books):
+        with self.lock:
+            self.max_books = max_books
+            self.books = {}
+            self.seen = set()
+            self.hits = 0
+            self.refetched = 0
+
+    @staticmethod
+    def key(asin):
+        try:
+            return int(asin, 36)
+        except ValueError:
+            return asin
+
+    def lookup(self, asin):
+        key = self.key(asin)
+        with self.lock:
+            book_info = self.books.get(key)
+            if book_info is not None:
+                self.hits += 1
+                result = 'hit'
+            elif key in self.seen:
+                self.refetched += 1
+                result = 'dropped'
+            else:
+                result = 'miss'
+        metrics.count('book_store_lookups', result=result)
+        return book_info
+
+    def add(self, book_info):
+        if self.max_books <= 0:
+            return
+        key = self.key(book_info.asin)
+        with self.lock:
+            self.books.pop(key, None)
+            self.books[key] = book_info
+            self.seen.add(key)
+            while len(self.books) > self.max_books:
+                del self.books[next(iter(self.books))]
+
+    def print_stats(self):
+        with self.lock:
+            if not self.hits and not self.refetched:
+                return
+            dropped = f", {self.refetched} fetched again after being dropped (book_store_size {self.max_books})" if self.refetched else ''
+            print(f"Book store: {len(self.books)} books kept, {self.hits} reused instead of fetched again{dropped}.")
+
+single_flight = SingleFlight()
+book_store = BookStore()
+
+def write_run_metrics(config):
+    metrics.print_stats()
+    metrics.write(config.get("metrics_path"), config.get("metrics_prometheus_path"))
+
+class CountingHTTPAdapter(HTTPAdapter):
+    # Counts the connections opened by the pool, so we can tell how many
+    # requests were served over an already open (keep-alive) connection.
+    def __init__(self, *args, **kwargs):
+        self.stats_lock = threading.Lock()
+        self.connections_opened = 0
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        adapter = self
+
+        def counting_pool(pool_class):
+            # Count socket connects rather than connection objects: the pool
+            # reconnects a closed connection object without creating a new one
+            class CountingConnection(pool_class.ConnectionCls):
+                def connect(self):
+                    with adapter.stats_lock:
+                        adapter.connections_opened += 1
+                    started = time.perf_counter()
+                    try:
+                        return super().connect()
+                    finally:
+                        metrics.observe('http_connect', time.perf_counter() - started)
+
+            class CountingPool(pool_class):
+                ConnectionCls = CountingConnection
+            return CountingPool
+
+        pool_classes = self.poolmanager.pool_classes_by_scheme
+        self.poolmanager.pool_classes_by_scheme = {scheme: counting_pool(pool_class) for scheme, pool_class in pool_classes.items()}
+
+class CachedResponse(object):
+    # A page served from the response cache, with the fields the crawl reads
+    def __init__(self, url, status_code, content, encoding, headers):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.encoding = encoding
+        self.headers = headers
+        self.from_cache = True
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+class ResponseCache(object):
+    # SQLite store of successful responses keyed on the URL after
+    # remove_language_parameter(). Entries younger than the TTL of their URL
+    # class are served without touching the network; older ones are
+    # revalidated with ETag/Last-Modified when the server sent them.
+    def __init__(self, path, ttls, max_bytes):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.ttls = ttls
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                status INTEGER,
+                body BLOB,
+                encoding TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL,
+                accessed_at REAL,
+                size INTEGER
+            )""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self.db.commit()
+        self.total_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evicted = 0
+        # Apply a lowered cache_max_mb straight away
+        with self.lock:
+            self.evict()
+            self.db.commit()
+
+    def ttl(self, url_class):
+        return self.ttls.get(url_class or 'default', self.ttls.get('default', 0))
+
+    def lookup(self, url, url_class):
+        # Returns (fresh cached response or None, conditional request headers)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT status, body, encoding, etag, last_modified, fetched_at FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None, {}
+            status, body, encoding, etag, last_modified, fetched_at = row
+            if time.time() - fetched_at < self.ttl(url_class):
+                self.hits += 1
+                self.db.execute("UPDATE responses SET accessed_at = ? WHERE url = ?", (time.time(), url))
+                self.db.commit()
+                return CachedResponse(url, status, zlib.decompress(body), encoding, {}), {}
+            self.misses += 1
+
+        validators = {}
+        if etag:
+            validators['If-None-Match'] = etag
+        if last_modified:
+            validators['If-Modified-Since'] = last_modified
+        return None, validators
+
+    def refresh(self, url):
+        # The server answered 304 Not Modified: restart the TTL and serve the stored copy
+        with self.lock:
+            now = time.time()
+            self.db.execute("UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE url = ?", (now, now, url))
+            self.db.commit()
+            row = self.db.execute("SELECT status, body, encoding FROM responses WHERE url = ?", (url,)).fetchone()
+            self.revalidated += 1
+        if row is None:
+            return None
+        status, body, encoding = row
+        return CachedResponse(url, status, zlib.decompress(body), encoding, {})
+
+    def store(self, url, status, content, encoding, headers):
+        body = zlib.compress(content)
+        now = time.time()
+        with self.lock:
+            old_row = self.db.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (url, status, body, encoding, etag, last_modified, fetched_at, accessed_at, size) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, status, body, encoding, headers.get('ETag'), headers.get('Last-Modified'), now, now, len(body))
+            )
+            self.total_bytes += len(body) - (old_row[0] if old_row else 0)
+            self.evict()
+            self.db.commit()
+
+    def delete(self, url):
+        with self.lock:
+            row = self.db.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return
+            self.db.execute("DELETE FROM responses WHERE url = ?", (url,))
+            self.total_bytes -= row[0]
+            self.db.commit()
+
+    def evict(self):
+        # Drop least recently used entries until the cache fits in max_bytes
+        while self.total_bytes > self.max_bytes:
+            rows = self.db.execute("SELECT url, size FROM responses ORDER BY accessed_at LIMIT 50").fetchall()
+            if not rows:
+                break
+            for url, size in rows:
+                self.db.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self.total_bytes -= size
+                self.evicted += 1
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+    def print_stats(self):
+        print(f"Cache: {self.hits} hits, {self.misses} misses, {self.revalidated} revalidated, {self.evicted} evicted ({self.total_bytes / 1048576:.1f} MB stored).")
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+def create_response_cache(config):
+    if not config.get("cache_enabled", True):
+        return None
+    ttls = dict(default_config["cache_ttl"])
+    ttls.update(config.get("cache_ttl") or {})
+    max_bytes = float(config.get("cache_max_mb", 500)) * 1048576
+    return ResponseCache(config.get("cache_path", "cache/responses.sqlite"), ttls, max_bytes)
+
+# Elements of a product page that parse_book_page reads
+product_page_sections = ['productTitle', 'landingImage', 'detailBullets_feature_div', 'bylineInfo', 'bookDescription_feature_div']
+
+class SectionTracker(HTMLParser):
+    # Follows a page while it streams in and notes when every element with one
+    # of the given ids has been closed. Nothing after that point can change
+    # what parse_book_page extracts, so the rest of the body can be skipped.
+    void_tags = {'img', 'input', 'meta', 'link', 'br', 'hr', 'source', 'area', 'wbr'}
+
+    def __init__(self, section_ids):
+        super().__init__(convert_charrefs=False)
+        self.pending = set(section_ids)
+        # id -> [tag name, nesting depth of that tag inside the section]
+        self.open_sections = {}
+        self.needs_fullscreen = False
+        self.seen_fullscreen = False
+
+    @property
+    def done(self):
+        return not self.pending and not self.open_sections and (self.seen_fullscreen or not self.needs_fullscreen)
+
+    def handle_starttag(self, tag, attrs):
+        for section in self.open_sections.values():
+            if section[0] == tag:
+                section[1] += 1
+
+        attrs = dict(attrs)
+        if tag == 'img' and 'fullscreen' in (attrs.get('class') or '').split():
+            self.seen_fullscreen = True
+
+        section_id = attrs.get('id')
+        if section_id not in self.pending:
+            return
+        self.pending.discard(section_id)
+        if section_id == 'landingImage' and not attrs.get('data-a-dynamic-image'):
+            # parse_book_page falls back to the fullscreen image in this case
+            self.needs_fullscreen = True
+        if tag not in self.void_tags:
+            self.open_sections[section_id] = [tag, 1]
+
+    def handle_endtag(self, tag):
+        for section_id, section in list(self.open_sections.items()):
+            if section[0] == tag:
+                section[1] -= 1
+                if section[1] == 0:
+                    del self.open_sections[section_id]
+
+class PageStreamReader(object):
+    # Collects the chunks of a streamed page and tells the caller when it can stop
+    def __init__(self, section_ids, encoding):
+        self.tracker = SectionTracker(section_ids)
+        try:
+            self.decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        except LookupError:
+            self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.chunks = []
+        self.bytes_read = 0
+
+    def feed(self, chunk):
+        self.chunks.append(chunk)
+        self.bytes_read += len(chunk)
+        if self.tracker is None:
+            return False
+        try:
+            self.tracker.feed(self.decoder.decode(chunk))
+        except Exception:
+            # Markup the tracker cannot follow; read the whole page instead
+            self.tracker = None
+            return False
+        return self.tracker.done
+
+    @property
+    def content(self):
+        return b''.join(self.chunks)
+
+class StreamedResponse(CachedResponse):
+    # A page read through PageStreamReader; truncated when we stopped early
+    def __init__(self, url, status_code, content, encoding, headers, truncated):
+        super().__init__(url, status_code, content, encoding, headers)
+        self.from_cache = False
+        self.truncated = truncated
+
+class CrawlSession(object):
+    # One pooled HTTP session shared by every fetch of a crawl. All requests go
+    # through get(), which consults the response cache, applies the per-host
+    # rate limit and counts requests.
+    def __init__(self, config, rate_controller=None, cache=None):
+        pool_size = max(1, int(config.get("pool_size", 10)))
+        self.adapter = CountingHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+        # ACCEPT_ENCODING includes br/zstd when the matching decoder is installed
+        self.session.headers.update({
+            "User-Agent": random.choice(user_agents_list),
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+            "Accept-Encoding": ACCEPT_ENCODING,
+            "Connection": "keep-alive" if config.get("keep_alive", True) else "close"
+        })
+        self.session.headers.update(config.get("default_headers") or {})
+
+        self.pool_size = pool_size
+        self.timeout = config.get("request_timeout", 30)
+        self.rate_controller = rate_controller
+        self.cache = cache
+        self.stream_product_pages = config.get("stream_product_pages", True)
+        self.stream_chunk_size = int(config.get("stream_chunk_size", 16384))
+        self.stats_lock = threading.Lock()
+        self.requests_sent = 0
+        self.streamed_pages = 0
+        self.streams_stopped_early = 0
+        self.stream_bytes_read = 0
+        self.stream_bytes_saved = 0
+        # Pages whose full size is known, to estimate the savings on early
+        # stops without a Content-Length (chunked responses)
+        self.full_pages = 0
+        self.full_page_bytes = 0
+        self.unsized_stops = 0
+        self.unsized_stop_bytes_read = 0
+
+    def cached_response(self, cache_key, url_class, headers):
+        # Returns (cached response or None, headers to send with the request)
+        if self.cache is None:
+            return None, headers
+        cached, validators = self.cache.lookup(cache_key, url_class)
+        metrics.count('cache_lookups', url_class=url_class or 'default', result='hit' if cached else 'miss')
+        if validators:
+            headers = dict(headers or {}, **validators)
+        return cached, headers
+
+    def remember_response(self, cache_key, status_code, content, encoding, response_headers):
+        # Returns the stored copy when the server confirmed it is still current
+        if self.cache is None:
+            return None
+        if status_code == 304:
+            metrics.count('cache_revalidations')
+            return self.cache.refresh(cache_key)
+        if status_code == 200:
+            self.cache.store(cache_key, status_code, content, encoding, response_headers)
+        return None
+
+    def forget_response(self, url):
+        # Drop a page that answered 200 but is not what was asked for (e.g. a
+        # robot check), so the next attempt goes to the network
+        if self.cache is not None:
+            self.cache.delete(remove_language_parameter(url))
+
+    def send(self, url, headers=None, url_class=None, **kwargs):
+        # Every request that reaches the network goes through the rate controller
+        url_class = url_class or 'default'
+        if self.rate_controller:
+            started = time.perf_counter()
+            self.rate_controller.wait(url)
+            metrics.observe('http_request', time.perf_counter() - started, url_class=url_class, phase='rate_wait')
+        with self.stats_lock:
+            self.requests_sent += 1
+        started = time.perf_counter()
+        try:
+            response = self.session.get(url, headers=headers, **kwargs)
+        except requests.exceptions.Timeout:
+            metrics.count('http_errors', url_class=url_class, error='timeout')
+            if self.rate_controller:
+                self.rate_controller.record_error(url, "timeout")
+            raise
+        except requests.exceptions.ConnectionError:
+            metrics.count('http_errors', url_class=url_class, error='connection')
+            if self.rate_controller:
+                self.rate_controller.record_error(url, "connection error")
+            raise
+        # elapsed runs until the response headers arrived; a streamed body
+        # is timed by whoever reads it
+        headers_seconds = response.elapsed.total_seconds()
+        metrics.count('http_responses', url_class=url_class, status=response.status_code)
+        metrics.observe('http_request', headers_seconds, url_class=url_class, phase='headers')
+        if not kwargs.get('stream'):
+            metrics.observe('http_request', max(0.0, time.perf_counter() - started - headers_seconds), url_class=url_class, phase='transfer')
+            metrics.count('http_bytes', len(response.content), url_class=url_class)
+        if self.rate_controller:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            self.rate_controller.record(url, response.status_code, headers_seconds, retry_after)
+        return response
+
+    def get(self, url, headers=None, url_class=None, use_cache=True, **kwargs):
+        # Concurrent requests for the same page share one response
+        key = ('get', remove_language_parameter(url), url_class, use_cache)
+        return single_flight.do(key, lambda: self.fetch(url, headers, url_class, use_cache, **kwargs))[0]
+
+    def fetch(self, url, headers=None, url_class=None, use_cache=True, **kwargs):
+        cache_key = remove_language_parameter(url)
+        if use_cache:
+            cached, headers = self.cached_response(cache_key, url_class, headers)
+            if cached:
+                return cached
+
+        kwargs.setdefault('timeout', self.timeout)
+        response = self.send(url, headers=headers, url_class=url_class, **kwargs)
+
+        if self.cache is not None and response.status_code in (200, 304):
+            encoding = response.encoding or response.apparent_encoding
+            cached = self.remember_response(cache_key, response.status_code, response.content, encoding, response.headers)
+            if cached:
+                return cached
+        return response
+
+    def get_streamed(self, url, headers=None, url_class=None, section_ids=product_page_sections, use_cache=True):
+        # Like get(), but stops reading the body and closes the connection as soon
+        # as every element in section_ids has been received. The cut-off body
+        # holds everything the extractors read, so it is cached like a full page.
+        key = ('stream', remove_language_parameter(url), url_class, use_cache)
+        return single_flight.do(key, lambda: self.fetch_streamed(url, headers, url_class, section_ids, use_cache))[0]
+
+    def fetch_streamed(self, url, headers=None, url_class=None, section_ids=product_page_sections, use_cache=True):
+        cache_key = remove_language_parameter(url)
+        if use_cache:
+            cached, headers = self.cached_response(cache_key, url_class, headers)
+            if cached:
+                return cached
+
+        with self.send(url, headers=headers, url_class=url_class, timeout=self.timeout, stream=True) as response:
+            started = time.perf_counter()
+            if response.status_code != 200:
+                cached = self.remember_response(cache_key, response.status_code, response.content, response.encoding, response.headers)
+                return cached or response
+
+            encoding = response.encoding or 'utf-8'
+            reader = PageStreamReader(section_ids, encoding)
+            truncated = False
+            for chunk in response.iter_content(self.stream_chunk_size):
+                if reader.feed(chunk):
+                    truncated = True
+                    break
+            # Bytes that came over the wire, before any gzip/br decoding. tell()
+            # stays 0 for chunked bodies; count those after decoding instead.
+            wire_bytes = response.raw.tell() or reader.bytes_read
+            metrics.observe('http_request', time.perf_counter() - started, url_class=url_class or 'default', phase='transfer')
+            metrics.count('http_bytes', wire_bytes, url_class=url_class or 'default')
+            content_length = response.headers.get('Content-Length')
+            total_bytes = int(content_length) if content_length and content_length.isdigit() else None
+            self.record_stream(wire_bytes, total_bytes, truncated)
+
+        content = reader.content
+        self.remember_response(cache_key, 200, content, encoding, response.headers)
+        return StreamedResponse(url, 200, content, encoding, response.headers, truncated)
+
+    def record_stream(self, bytes_read, total_bytes, truncated):
+        with self.stats_lock:
+            self.streamed_pages += 1
+            self.stream_bytes_read += bytes_read
+            if not truncated:
+                total_bytes = bytes_read
+            if total_bytes is not None:
+                self.full_pages += 1
+                self.full_page_bytes += total_bytes
+            if truncated:
+                self.streams_stopped_early += 1
+                if total_bytes is not None:
+                    self.stream_bytes_saved += max(0, total_bytes - bytes_read)
+                else:
+                    self.unsized_stops += 1
+                    self.unsized_stop_bytes_read += bytes_read
+
+    def print_stream_stats(self):
+        with self.stats_lock:
+            if not self.streamed_pages:
+                return
+            saved = f"{self.stream_bytes_saved / 1024:.0f} KB not downloaded"
+            if self.unsized_stops and self.full_pages:
+                # Assume a page of unknown length is as long as the average page of known length
+                estimate = self.stream_bytes_saved + max(0, self.unsized_stops * self.full_page_bytes / self.full_pages - self.unsized_stop_bytes_read)
+                saved = f"about {estimate / 1024:.0f} KB not downloaded ({self.unsized_stops} pages of unknown length estimated)"
+            elif self.unsized_stops:
+                known = f"{self.stream_bytes_saved / 1024:.0f} KB plus " if self.stream_bytes_saved else ''
+                saved = f"{known}the unknown rest of {self.unsized_stops} pages sent without a length not downloaded"
+            print(f"Streaming: {self.streamed_pages} product pages, {self.streams_stopped_early} stopped early, "
+                  f"{self.stream_bytes_read / 1024:.0f} KB read, {saved}.")
+
+    def connection_stats(self):
+        with self.stats_lock:
+            requests_sent = self.requests_sent
+        connections = self.adapter.connections_opened
+        return {
+            'requests': requests_sent,
+            'connections': connections,
+            'reused': max(0, requests_sent - connections)
+        }
+
+    def print_stats(self):
+        stats = self.connection_stats()
+        print(f"HTTP: {stats['requests']} requests over {stats['connections']} connections ({stats['reused']} handshakes saved by keep-alive).")
+        self.print_stream_stats()
+        if self.rate_controller:
+            self.rate_controller.print_stats()
+        if self.cache is not None:
+            self.cache.print_stats()
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+def create_session(config=None):
+    if config is None:
+        config = load_config()
+    rate_controller = AdaptiveRateController(
+        float(config.get("max_requests_per_second", 0)),
+        initial_rate=float(config.get("initial_requests_per_second", 1.0)),
+        min_rate=float(config.get("min_requests_per_second", 0.2))
+    )
+    return CrawlSession(config, rate_controller=rate_controller, cache=create_response_cache(config))
+
+class CrawlTransport(object):
+    # Runs crawl flows. The steps of a crawl (search, series pages, book pages)
+    # are written once, as generators that yield the I/O they need as
+    # (operation, *args) steps. The transport carries out each step with its
+    # method of that name and sends the result back into the flow, or throws
+    # the step's exception into it, so flows handle errors like plain code.
+    # Only the transports differ between the sync and the async engine.
+    def run(self, flow):
+        result = error = None
+        while True:
+            try:
+                step = flow.send(result) if error is None else flow.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                result, error = getattr(self, step[0])(*step[1:]), None
+            except BaseException as e:
+                result, error = None, e
+
+class SessionTransport(CrawlTransport):
+    # Blocking steps on the requests session; series pages on a thread pool
+    def __init__(self, session, max_workers=4):
+        self.session = session
+        self.max_workers = max_workers
+
+    def get(self, url, headers=None, url_class=None, use_cache=True, streamed=False):
+        # streamed: a product page that may be read only up to its last section
+        if streamed and self.session.stream_product_pages:
+            return self.session.get_streamed(url, headers=headers, url_class=url_class, use_cache=use_cache)
+        return self.session.get(url, headers=headers, url_class=url_class, use_cache=use_cache)
+
+    def parse(self, function, *args):
+        return page_parser.parse(function, *args)
+
+    def forget(self, url):
+        self.session.forget_response(url)
+
+    def pause(self, listing, seconds):
+        listing.pause(seconds)
+
+    def coalesce(self, key, flow):
+        # Returns (result, shared) as SingleFlight.do()
+        return single_flight.do(key, lambda: self.run(flow))
+
+    def start(self, flow):
+        # Run a flow in the background
+        threading.Thread(target=self.run, args=(flow,), daemon=True).start()
+
+    def add_pages(self, listing, flows):
+        # Run the series page flows in parallel; map() keeps page order, so a
+        # page's books are listed as soon as the pages before it are in
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(flows)))) as executor:
+            for page_books in executor.map(self.run, flows):
+                if listing.cancelled:
+                    break
+                listing.add(page_books)
+
+class PageParser(object):
+    # Builds soups with the configured parser backend and records how long
+    # each kind of page takes to parse and extract. With start_workers() the
+    # extractors run in a pool of worker processes, so parsing is not held
+    # to one core by the GIL; only the page text goes to a worker and only
+    # the extracted record comes back.
+    def __init__(self, backend='auto'):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.pool = None
+        self.configure(backend)
+
+    def configure(self, backend):
+        if backend in (None, 'auto'):
+            backend = 'lxml' if lxml_available else 'html.parser'
+        elif backend == 'lxml' and not lxml_available:
+            print("lxml is not installed; falling back to html.parser.")
+            backend = 'html.parser'
+        self.backend = backend
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            # kind -> [pages parsed, total seconds]
+            self.timings = {}
+            # worker process id -> [pages parsed, total seconds]
+            self.worker_timings = {}
+
+    def start_workers(self, workers):
+        self.stop_workers()
+        if workers > 0:
+            self.pool = ProcessPoolExecutor(max_workers=workers, initializer=start_parse_worker, initargs=(self.backend,))
+            self.workers = workers
+
+    def stop_workers(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
+
+    def parse(self, function, *args):
+        # Run a @timed_parse extractor, in a worker process when there is a pool
+        if self.pool is None:
+            return function(*args)
+        return self.worker_result(self.pool.submit(parse_in_worker, function, args).result())
+
+    async def parse_async(self, function, *args):
+        # parse() for coroutines. The page is parsed in a thread or a worker
+        # process, so the event loop keeps serving requests in the meantime.
+        if self.pool is None:
+            return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+        return self.worker_result(await asyncio.wrap_future(self.pool.submit(parse_in_worker, function, args)))
+
+    def worker_result(self, outcome):
+        # Record what a worker measured, since its own statistics stay in its process
+        result, kind, seconds, soup_seconds, worker, output = outcome
+        if output:
+            print(output, end='')
+        self.record_page(kind, seconds, soup_seconds)
+        with self.lock:
+            timing = self.worker_timings.setdefault(worker, [0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+            worker_number = list(self.worker_timings).index(worker) + 1
+        metrics.count('parse_worker_pages', worker=worker_number)
+        return result
+
+    def record_page(self, kind, seconds, soup_seconds):
+        self.record(kind, seconds)
+        metrics.observe('parse', soup_seconds, kind=kind, phase='parse')
+        metrics.observe('parse', seconds - soup_seconds, kind=kind, phase='extract')
+
+    def soup(self, html_content, parse_only=None):
+        started = time.perf_counter()
+        try:
+            return BeautifulSoup(html_content, self.backend, parse_only=parse_only)
+        finally:
+            # timed_parse splits a page's time into building the soup and extracting
+            self.local.soup_seconds = getattr(self.local, 'soup_seconds', 0.0) + time.perf_counter() - started
+
+    def record(self, kind, seconds):
+        with self.lock:
+            timing = self.timings.setdefault(kind, [0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+
+    def print_stats(self):
+        with self.lock:
+            timings = sorted(self.timings.items())
+        if not timings:
+            return
+        summary = ', '.join(f"{kind} {pages} pages at {seconds / pages * 1000:.1f} ms/page" for kind, (pages, seconds) in timings)
+        print(f"Parsing ({self.backend}): {summary}.")
+        with self.lock:
+            worker_timings = list(self.worker_timings.values())
+        if worker_timings:
+            summary = ', '.join(f"#{number} {pages} pages at {pages / seconds if seconds else 0:.0f} pages/s"
+                                for number, (pages, seconds) in enumerate(worker_timings, 1))
+            print(f"Parse workers ({len(worker_timings)} used): {summary}.")
+
+page_parser = PageParser()
+
+def start_parse_worker(backend):
+    # Runs once in every parse worker process. Ctrl+C is left to the main
+    # process, which shuts the pool down.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    page_parser.configure(backend)
+
+def parse_in_worker(function, args):
+    # Runs in a parse worker: returns the extracted result with its kind,
+    # timings, the worker's process id and anything the extractor printed
+    output = io.StringIO()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        result = function(*args)
+    seconds = time.perf_counter() - started
+    return result, function.parse_kind, seconds, page_parser.local.soup_seconds, os.getpid(), output.getvalue()
+
+def timed_parse(kind):
+    # Record the time spent building the soup and extracting fields from one page
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            page_parser.local.soup_seconds = 0.0
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                page_parser.record_page(kind, time.perf_counter() - started, page_parser.local.soup_seconds)
+        wrapper.parse_kind = kind
+        return wrapper
+    return decorator
+
+def class_pattern(class_name):
+    # Strainers see the raw class attribute, so match one name inside the list
+    return re.compile(r'(^|\s)' + re.escape(class_name) + r'(\s|$)')
+
+# Only the parts of each page we read are built into a tree
+series_title_strainer = SoupStrainer('span', attrs={'id': 'collection-title'})
+series_anchor_strainer = SoupStrainer('a', attrs={'class': class_pattern('a-link-normal')})
+search_result_strainer = SoupStrainer('div', attrs={'data-component-type': 's-search-result'})
+series_item_strainer = SoupStrainer('a', attrs={'id': re.compile(r'itemBookTitle_\d+')})
+series_page_strainer = SoupStrainer(attrs={'id': re.compile(r'^(seriesImageBlock|collection-title|collection_description|collection-size|itemBookTitle_\d+)$')})
+series_contributor_strainer = SoupStrainer('span', attrs={'data-action': 'a-popover'})
+product_page_strainer = SoupStrainer(attrs={'id': ['productTitle', 'landingImage', 'detailBullets_feature_div', 'bylineInfo', 'bookDescription_feature_div']})
+product_fullscreen_strainer = SoupStrainer('img', attrs={'class': class_pattern('fullscreen')})
+
 def sanitize_filename(name):
     # Remove invalid characters for filenames
     return re.sub(r'[\\/*?:"<>|]', "", name)
 
-def get_series_link(base_url, search_input):
-    series_link = None
+class Record(object):
+    # Base of the series and book records. Every field is a slot, so a batch
+    # holding tens of thousands of books stays small. `fields` lists
+    # (key, slot, factory): the keys are the names used by the export
+    # template, manifests and JSONL files ('Books ASINs', 'largeImage', ...),
+    # and records can still be read and updated by key like a dict.
+    __slots__ = ()
+    fields = ()
+
+    def __init__(self, **values):
+        for key, name, factory in self.fields:
+            setattr(self, name, values.pop(name) if name in values else factory())
+        if values:
+            raise TypeError(f"Unknown {type(self).__name__} fields: {', '.join(values)}")
+
+    @classmethod
+    def from_dict(cls, data):
+        # Unknown keys are dropped and missing ones get their default
+        record = cls.__new__(cls)
+        for key, name, factory in cls.fields:
+            value = data.get(key)
+            setattr(record, name, factory() if value is None else value)
+        return record
+
+    def to_dict(self):
+        return {key: getattr(self, name) for key, name, factory in self.fields}
+
+    def copy(self, changes=None):
+        # A shallow copy, with the given keys replaced
+        record = self.__new__(type(self))
+        for name in self.__slots__:
+            setattr(record, name, getattr(self, name))
+        for key, value in (changes or {}).items():
+            record[key] = value
+        return record
+
+    def __getitem__(self, key):
+        return getattr(self, self.slot_names[key])
+
+    def __setitem__(self, key, value):
+        setattr(self, self.slot_names[key], value)
+
+    def __contains__(self, key):
+        return key in self.slot_names
+
+    def get(self, key, default=None):
+        name = self.slot_names.get(key)
+        return getattr(self, name) if name else default
+
+    def keys(self):
+        return [key for key, name, factory in self.fields]
+
+    def items(self):
+        return [(key, getattr(self, name)) for key, name, factory in self.fields]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+class Series(Record):
+    fields = (
+        ('Series Title', 'title', str),
+        ('Series Image URL', 'image_url', str),
+        ('Series Description', 'description', str),
+        ('Authors', 'authors', list),
+        ('Illustrators', 'illustrators', list),
+        ('Books ASINs', 'asins', list)
+    )
+    __slots__ = tuple(name for key, name, factory in fields)
+    slot_names = {key: name for key, name, factory in fields}
+
+class Book(Record):
+    fields = (
+        ('Title', 'title', str),
+        ('thumbnail', 'thumbnail', str),
+        ('largeImage', 'large_image', str),
+        ('Description', 'description', dict),
+        ('Preface', 'preface', str),
+        ('Authors', 'authors', list),
+        ('Illustrators', 'illustrators', list),
+        ('ASIN', 'asin', str)
+    )
+    __slots__ = tuple(name for key, name, factory in fields)
+    slot_names = {key: name for key, name, factory in fields}
+
+def record_to_json(value):
+    # json.dump default= hook for structures that contain records
+    if isinstance(value, Record):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+@timed_parse('link')
+def parse_series_link_page(html_content, base_url, page_url):
+    # Check if it's already a series link
+    series_title = page_parser.soup(html_content, series_title_strainer).find('span', {'id': 'collection-title'})
+    if series_title:
+        return page_url  # Input is already a series link
+
+    # Find series link in the page
+    soup = page_parser.soup(html_content, series_anchor_strainer)
+    anchor_tags = soup.find_all('a', {'class': 'a-link-normal'})
+
+    for anchor in anchor_tags:
+        href = anchor.get('href', '')
+        if href.startswith('dbs_'):
+            full_link = urllib.parse.urljoin(base_url, href)
+            return full_link
+    print("No series link found in the provided URL.")
+    return None
+
+def search_page_url(base_url, search_input):
+    encoded_book_name = urllib.parse.quote(search_input)
+    return f"{base_url}/s?k={encoded_book_name}&i=digital-text"
+
+@timed_parse('search')
+def parse_search_results(html_content, base_url):
+    soup = page_parser.soup(html_content, search_result_strainer)
+    search_results = soup.find_all('div', {'data-component-type': 's-search-result'})
+
+    results = []
+    for result in search_results:
+        data_index = result.get('data-index')
+        data_asin = result.get('data-asin')
+
+        image_tag = result.find('img', {'class': 's-image'})
+        alt_text = image_tag.get('alt') if image_tag else ''
+
+        anchor_tag = result.find('a', {'class': 'a-link-normal s-underline-text s-underline-link-text s-link-style'})
+        href = anchor_tag.get('href') if anchor_tag else ''
+        full_link = urllib.parse.urljoin(base_url, href) if href else ''
+
+        results.append({
+            'data_index': data_index,
+            'data_asin': data_asin,
+            'alt_text': alt_text,
+            'series_link': full_link
+        })
+
+    # Remove items where the series link is empty
+    results = [item for item in results if item['series_link']]
+    return results
+
+def prefer_bunko_item(results):
+    # The most similar item, except that a 文庫 edition wins over items that
+    # are only slightly more similar
+    results_with_similarity = sorted(results, key=lambda x: x['similarity'], reverse=True)
+    if not results_with_similarity:
+        return None
+
+    # Handle items with close similarity scores
+    top_similarity = results_with_similarity[0]['similarity']
+    top_items = [item for item in results_with_similarity if abs(item['similarity'] - top_similarity) < 0.2]
+    for item in top_items:
+        if '文庫' in item['alt_text']:
+            return item
+    return results_with_similarity[0]
+
+def choose_series_link(results, search_input):
+    # Use difflib to find the best match based on word-level similarity
+    best_match = None
+    highest_similarity = 0
+
+    # Assign similarity score to each item
+    for item in results:
+        # Split the alt_text into words
+        alt_words = item['alt_text'].split()
+        search_words = search_input.split()
+
+        # Calculate similarity based on word sets
+        similarity = difflib.SequenceMatcher(None, ' '.join(search_words), ' '.join(alt_words)).ratio()
+        item['similarity'] = similarity
+
+    best_match = prefer_bunko_item(results)
+    highest_similarity = best_match['similarity'] if best_match else 0
+
+    if best_match and highest_similarity > 0.3:
+        series_link = best_match['series_link']
+        print(f"Best match similarity: {highest_similarity * 100:.2f}%")
+        return series_link
+    else:
+        print("No matching series link found.")
+        return None
 
+@timed_stage('search')
+def series_link_flow(base_url, search_input):
     # Remove 'language' parameter from the input URL if present
     search_input = remove_language_parameter(search_input)
 
     if search_input.startswith('http'):
-        response = requests.get(search_input)
-        html_content = response.text
-        soup = BeautifulSoup(html_content, 'html.parser')
-
-        # Check if it's already a series link
-        series_title = soup.find('span', {'id': 'collection-title'})
-        if series_title:
-            return search_input  # Input is already a series link
-
-        # Find series link in the page
-        anchor_tags = soup.find_all('a', {'class': 'a-link-normal'})
-
-        for anchor in anchor_tags:
-            href = anchor.get('href', '')
-            if href.startswith('dbs_'):
-                full_link = urllib.parse.urljoin(base_url, href)
-                return full_link
-        print("No series link found in the provided URL.")
-        return None
+        response = yield ('get', search_input, None, 'series')
+        return (yield ('parse', parse_series_link_page, response.text, base_url, search_input))
     else:
-        encoded_book_name = urllib.parse.quote(search_input)
-        search_url = f"{base_url}/s?k={encoded_book_name}&i=digital-text"
+        search_url = search_page_url(base_url, search_input)
 
         headers = {"User-Agent": random.choice(user_agents_list)}
-        response = requests.get(search_url, headers=headers)
-        html_content = response.text
-
-        soup = BeautifulSoup(html_content, 'html.parser')
-        search_results = soup.find_all('div', {'data-component-type': 's-search-result'})
-
-        results = []
-        for result in search_results:
-            data_index = result.get('data-index')
-            data_asin = result.get('data-asin')
-
-            image_tag = result.find('img', {'class': 's-image'})
-            alt_text = image_tag.get('alt') if image_tag else ''
-
-            anchor_tag = result.find('a', {'class': 'a-link-normal s-underline-text s-underline-link-text s-link-style'})
-            href = anchor_tag.get('href') if anchor_tag else ''
-            full_link = urllib.parse.urljoin(base_url, href) if href else ''
-
-            results.append({
-                'data_index': data_index,
-                'data_asin': data_asin,
-                'alt_text': alt_text,
-                'series_link': full_link
-            })
-
-        # Remove items where the series link is empty
-        results = [item for item in results if item['series_link']]
-
-        # Use difflib to find the best match based on word-level similarity
-        best_match = None
-        highest_similarity = 0
-
-        # Assign similarity score to each item
-        for item in results:
-            # Split the alt_text into words
-            alt_words = item['alt_text'].split()
-            search_words = search_input.split()
-
-            # Calculate similarity based on word sets
-            similarity = difflib.SequenceMatcher(None, ' '.join(search_words), ' '.join(alt_words)).ratio()
-            item['similarity'] = similarity
-
-        # Now, sort the results based on similarity
-        results_with_similarity = sorted(results, key=lambda x: x['similarity'], reverse=True)
-
-        if results_with_similarity:
-            # Handle items with close similarity scores
-            top_similarity = results_with_similarity[0]['similarity']
-            top_items = [item for item in results_with_similarity if abs(item['similarity'] - top_similarity) < 0.2]
-            preferred_item = None
-
-            for item in top_items:
-                if '文庫' in item['alt_text']:
-                    preferred_item = item
-                    break
-            if not preferred_item:
-                preferred_item = results_with_similarity[0]
-
-            best_match = preferred_item
-            highest_similarity = best_match['similarity']
+        response = yield ('get', search_url, headers, 'search')
+        results = yield ('parse', parse_search_results, response.text, base_url)
+        return choose_series_link(results, search_input)
 
-        else:
-            best_match = None
-            highest_similarity = 0
+def get_series_link(base_url, search_input, session=None):
+    if session is None:
+        session = create_session()
+    return SessionTransport(session).run(series_link_flow(base_url, search_input))
 
-        if best_match and highest_similarity > 0.3:
-            series_link = best_match['series_link']
-            print(f"Best match similarity: {highest_similarity * 100:.2f}%")
-            return series_link
-        else:
-            print("No matching series link found.")
-            return None
+def parse_series_asins(soup):
+    # Get the ASINs of the books listed on one page of the series
+    books = []
+    for a_tag in soup.find_all('a', {'id': re.compile(r'itemBookTitle_\d+')}):
+        href = a_tag.get('href', '')
+        asin_match = re.search(r'/gp/product/(\w{10})', href)
+        if asin_match:
+            asin = asin_match.group(1)
+            books.append(asin)
+    return books
 
-def get_series_info(series_url, base_url):
-    series_url = remove_language_parameter(series_url)
-    print("Collecting page 1 info...")
-    response = requests.get(series_url)
-    html_content = response.text
-    soup = BeautifulSoup(html_content, 'html.parser')
+@timed_parse('series')
+def parse_series_page(html_content):
+    soup = page_parser.soup(html_content, series_page_strainer)
 
     # Get series image
     image_tag = soup.find('img', {'id': 'seriesImageBlock'})
@@ -183,7 +1524,8 @@ def get_series_info(series_url, base_url):
     illustrators = []
 
     # Find all contributor spans
-    contributor_spans = soup.find_all('span', {'class': 'a-declarative', 'data-action': 'a-popover'})
+    contributor_soup = page_parser.soup(html_content, series_contributor_strainer)
+    contributor_spans = contributor_soup.find_all('span', {'class': 'a-declarative', 'data-action': 'a-popover'})
 
     for contributor_span in contributor_spans:
         # Get the text content
@@ -217,13 +1559,7 @@ def get_series_info(series_url, base_url):
     illustrators = list(set(illustrators))
 
     # Get books in the series from the first page (HTML parsing)
-    books = []
-    for a_tag in soup.find_all('a', {'id': re.compile(r'itemBookTitle_\d+')}):
-        href = a_tag.get('href', '')
-        asin_match = re.search(r'/gp/product/(\w{10})', href)
-        if asin_match:
-            asin = asin_match.group(1)
-            books.append(asin)
+    books = parse_series_asins(soup)
 
     # Get total number of books in the series
     collection_size_tag = soup.find('span', {'id': 'collection-size'})
@@ -236,183 +1572,392 @@ def get_series_info(series_url, base_url):
     else:
         print("Unable to determine the total number of books in the series.")
 
+    series_info = Series(
+        title=series_title,
+        image_url=series_image,
+        description=series_description,
+        authors=authors,
+        illustrators=illustrators,
+        asins=books
+    )
+
+    return series_info, total_books
+
+@timed_parse('series')
+def parse_series_page_asins(html_content):
+    return parse_series_asins(page_parser.soup(html_content, series_item_strainer))
+
+def series_page_url(series_url, page_number):
+    # Construct the URL for the given page of the series
+    parsed_url = urllib.parse.urlparse(series_url)
+    query_params = urllib.parse.parse_qs(parsed_url.query)
+    query_params['pageNumber'] = [str(page_number)]
+    query_string = urllib.parse.urlencode(query_params, doseq=True)
+    page_url = urllib.parse.urlunparse(parsed_url._replace(query=query_string))
+    return remove_language_parameter(page_url)
+
+def series_page_count(total_books):
+    # Series pages list 10 books each
+    return math.ceil(total_books / 10) if total_books > 10 else 1
+
+def series_page_asins_flow(page_url, page_number):
+    # The page's ASINs, or None when it could not be fetched
+    print(f"Collecting page {page_number}...")
+    try:
+        response = yield ('get', page_url, None, 'series')
+    except Exception as e:
+        print(f"Failed to fetch page {page_number}: {e!r}")
+        return None
+    if response.status_code == 200:
+        return (yield ('parse', parse_series_page_asins, response.text))
+    print(f"Failed to fetch page {page_number}. Status code: {response.status_code}")
+    return None
+
+class SeriesListing(object):
+    # A series whose first page has been read while its other pages are still
+    # being fetched. series_info.asins grows in series order as the pages come
+    # in, without duplicates. Iterating yields every ASIN once and waits for
+    # the pages still to come, so book fetches can start right after page 1.
+    def __init__(self, series_info, total_books, started):
+        self.series_info = series_info
+        # The count page 1 states; the list can end up shorter after duplicates are removed
+        self.total_books = total_books
+        self.started = started
+        self.condition = threading.Condition()
+        self.seen = set()
+        self.done = False
+        self.error = None
+        # Set when the crawl was stopped; pages not fetched yet are skipped
+        self.cancelled = False
+        page_books = series_info.asins
+        series_info.asins = []
+        self.add(page_books)
+
+    def add(self, page_books):
+        # Pages have to be added in series order
+        with self.condition:
+            for asin in page_books:
+                if asin not in self.seen:
+                    self.seen.add(asin)
+                    self.series_info.asins.append(asin)
+            self.condition.notify_all()
+
+    def finish(self, error=None):
+        with self.condition:
+            self.done = True
+            self.error = error
+            self.condition.notify_all()
+        metrics.observe('stage', time.perf_counter() - self.started, stage='series')
+
+    def cancel(self):
+        with self.condition:
+            self.cancelled = True
+            self.condition.notify_all()
+
+    def pause(self, seconds):
+        # A page's retry backoff, cut short when the crawl is stopped
+        with self.condition:
+            self.condition.wait_for(lambda: self.cancelled, seconds)
+
+    def __iter__(self):
+        asins = self.series_info.asins
+        position = 0
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.done or position < len(asins))
+                new_books = asins[position:]
+                if not new_books:
+                    if self.error is not None:
+                        raise self.error
+                    return
+            position += len(new_books)
+            yield from new_books
+
+    def wait(self):
+        # The complete series_info, once every page is in
+        with self.condition:
+            self.condition.wait_for(lambda: self.done)
+        if self.error is not None:
+            raise self.error
+        return self.series_info
+
+def series_listing_flow(series_url, base_url):
+    # Read page 1 and leave the other pages to a background flow
+    started = time.perf_counter()
+    series_url = remove_language_parameter(series_url)
+    print("Collecting page 1 info...")
+    response = yield ('get', series_url, None, 'series')
+    series_info, total_books = yield ('parse', parse_series_page, response.text)
+    listing = SeriesListing(series_info, total_books, started)
+
     if total_books > 10:
         # Calculate the total number of pages
-        total_pages = math.ceil(total_books / 10)
+        total_pages = series_page_count(total_books)
         print(f"Total pages: {total_pages}")
-
-        # Fetch additional pages (from page 2 onwards)
-        for page_number in range(2, total_pages + 1):
-            print(f"Collecting page {page_number}...")
-            # Pause to queue the website loading
-            time.sleep(1)
-            # Construct the URL for the next page
-            parsed_url = urllib.parse.urlparse(series_url)
-            query_params = urllib.parse.parse_qs(parsed_url.query)
-            query_params['pageNumber'] = [str(page_number)]
-            query_string = urllib.parse.urlencode(query_params, doseq=True)
-            page_url = urllib.parse.urlunparse(parsed_url._replace(query=query_string))
-            page_url = remove_language_parameter(page_url)
-
-            response = requests.get(page_url)
-            if response.status_code == 200:
-                page_html = response.text
-                page_soup = BeautifulSoup(page_html, 'html.parser')
-                for a_tag in page_soup.find_all('a', {'id': re.compile(r'itemBookTitle_\d+')}):
-                    href = a_tag.get('href', '')
-                    asin_match = re.search(r'/gp/product/(\w{10})', href)
-                    if asin_match:
-                        asin = asin_match.group(1)
-                        books.append(asin)
-            else:
-                print(f"Failed to fetch page {page_number}. Status code: {response.status_code}")
+        yield ('start', collect_series_pages_flow(listing, series_url, total_pages))
     else:
         print("Only one page of results found.")
+        listing.finish()
+    return listing
 
-    # Remove duplicates
-    books = list(dict.fromkeys(books))
-
-    series_info = {
-        'Series Title': series_title,
-        'Series Image URL': series_image,
-        'Series Description': series_description,
-        'Authors': authors,
-        'Illustrators': illustrators,
-        'Books ASINs': books
-    }
+def shared_series_listing_flow(series_url, base_url):
+    # The same series requested by several queries at once is fetched once
+    listing, shared = yield ('coalesce', ('series', remove_language_parameter(series_url)), series_listing_flow(series_url, base_url))
+    return listing
+
+def series_page_flow(listing, series_url, page_number, deadline):
+    # A failed page is tried again after its own backoff, like a failed book
+    attempt = 1
+    while not listing.cancelled:
+        page_books = yield from series_page_asins_flow(series_page_url(series_url, page_number), page_number)
+        if page_books is not None:
+            return page_books
+        delay = retry_policy.backoff(attempt, deadline)
+        if delay is None:
+            print(f"Giving up on page {page_number} after {attempt} attempts.")
+            break
+        yield ('pause', listing, delay)
+        attempt += 1
+    return []
 
-    return series_info
+def collect_series_pages_flow(listing, series_url, total_pages):
+    # Every remaining page URL is known now, so fetch pages 2..N in parallel.
+    # The session's rate limiter paces the requests.
+    deadline = retry_policy.deadline(time.monotonic())
+    error = None
+    try:
+        yield ('add_pages', listing, [series_page_flow(listing, series_url, page_number, deadline)
+                                      for page_number in range(2, total_pages + 1)])
+    except Exception as e:
+        error = e
+    finally:
+        listing.finish(error)
 
-def get_books_info(base_url, asin, headers=None):
+def get_series_listing(series_url, base_url, session=None, max_workers=4):
+    if session is None:
+        session = create_session()
+    return SessionTransport(session, max_workers).run(series_listing_flow(series_url, base_url))
+
+def get_series_info(series_url, base_url, session=None, max_workers=4):
+    return get_series_listing(series_url, base_url, session, max_workers).wait()
+
+def book_page_urls(base_url, asin):
     book_urls = [
         f"{base_url}/dp/{asin}",
         f"{base_url}/zh/dp/{asin}"
     ]
+    return [remove_language_parameter(url) for url in book_urls]
 
-    book_info = None
-    last_exception = None
-    response = None  # Initialize response
+@timed_parse('product')
+def parse_book_page(html_content, asin):
+    soup = page_parser.soup(html_content, product_page_strainer)
 
-    for url in book_urls:
-        url = remove_language_parameter(url)
-        try:
-            response = requests.get(url, headers=headers)
-            if response.status_code != 200:
-                print(f"Received status code {response.status_code} for URL {url}")
-                continue
-            html_content = response.text
-            soup = BeautifulSoup(html_content, 'html.parser')
-
-            # Initialize book_info dictionary
-            book_info = {}
-
-            # 0. Get book title
-            title_tag = soup.find('span', {'id': 'productTitle'})
-            book_title = title_tag.text.strip() if title_tag else ''
-            book_info['Title'] = book_title
-
-            # 1. Get thumbnail image link
-            thumbnail_tag = soup.find('img', {'id': 'landingImage'})
-            if thumbnail_tag:
-                thumbnail = thumbnail_tag.get('src', '')
-                # Remove size specifier to get the largest image
-                thumbnail = re.sub(r'\._[A-Z0-9,]+_\.', '.', thumbnail)
-                book_info['thumbnail'] = thumbnail
-
-            # 2. Get large image link
-            if thumbnail_tag:
-                data_dynamic_image = thumbnail_tag.get('data-a-dynamic-image', '')
-                if data_dynamic_image:
-                    try:
-                        images_dict = json.loads(data_dynamic_image)
-                        # Assuming the largest image has the highest resolution
-                        large_image = max(images_dict.keys(), key=lambda x: images_dict[x][0]*images_dict[x][1])
-                        # Remove size specifier from large image URL
-                        large_image = re.sub(r'\._[^_]+_', '', large_image)
-                        book_info['largeImage'] = large_image
-                    except json.JSONDecodeError:
-                        book_info['largeImage'] = ''
+    # Only plain strings are kept, never parts of the soup
+    book_info = Book(asin=asin)
+
+    # 0. Get book title
+    title_tag = soup.find('span', {'id': 'productTitle'})
+    book_title = title_tag.text.strip() if title_tag else ''
+    book_info.title = book_title
+
+    # 1. Get thumbnail image link
+    thumbnail_tag = soup.find('img', {'id': 'landingImage'})
+    if thumbnail_tag:
+        thumbnail = thumbnail_tag.get('src', '')
+        # Remove size specifier to get the largest image
+        thumbnail = re.sub(r'\._[A-Z0-9,]+_\.', '.', thumbnail)
+        book_info.thumbnail = thumbnail
+
+    # 2. Get large image link
+    if thumbnail_tag:
+        data_dynamic_image = thumbnail_tag.get('data-a-dynamic-image', '')
+        if data_dynamic_image:
+            try:
+                images_dict = json.loads(data_dynamic_image)
+                # Assuming the largest image has the highest resolution
+                large_image = max(images_dict.keys(), key=lambda x: images_dict[x][0]*images_dict[x][1])
+                # Remove size specifier from large image URL
+                large_image = re.sub(r'\._[^_]+_', '', large_image)
+                book_info.large_image = large_image
+            except json.JSONDecodeError:
+                book_info.large_image = ''
+        else:
+            # Fallback if data-a-dynamic-image is not available
+            fullscreen_soup = page_parser.soup(html_content, product_fullscreen_strainer)
+            large_image_tag = fullscreen_soup.find('img', {'class': 'fullscreen'})
+            large_image = large_image_tag.get('src', '') if large_image_tag else ''
+            # Remove size specifier from large image URL
+            large_image = re.sub(r'\._[^_]+_', '', large_image)
+            book_info.large_image = large_image
+
+
+    # 3. Get Description as a dictionary
+    description_dict = {}
+    detail_bullets = soup.find('div', {'id': 'detailBullets_feature_div'})
+    if detail_bullets:
+        # Extract all list items
+        for li in detail_bullets.find_all('li'):
+            spans = li.find_all('span', {'class': 'a-list-item'})
+            for s in spans:
+                text = s.get_text(separator=' ', strip=True)
+                # Remove unnecessary whitespaces and colons
+                text = re.sub(r'\s+', ' ', text)
+                text = text.replace('‎', '').replace('‏', '').strip()
+                if ':' in text:
+                    key_value = text.split(':', 1)
+                    key = key_value[0].strip()
+                    value = key_value[1].strip()
+                    # The same few labels repeat on every book; share one copy
+                    description_dict[sys.intern(key)] = value
                 else:
-                    # Fallback if data-a-dynamic-image is not available
-                    large_image_tag = soup.find('img', {'class': 'fullscreen'})
-                    large_image = large_image_tag.get('src', '') if large_image_tag else ''
-                    # Remove size specifier from large image URL
-                    large_image = re.sub(r'\._[^_]+_', '', large_image)
-                    book_info['largeImage'] = large_image
-            else:
-                book_info['largeImage'] = ''
-
-
-            # 3. Get Description as a dictionary
-            description_dict = {}
-            detail_bullets = soup.find('div', {'id': 'detailBullets_feature_div'})
-            if detail_bullets:
-                # Extract all list items
-                for li in detail_bullets.find_all('li'):
-                    spans = li.find_all('span', {'class': 'a-list-item'})
-                    for s in spans:
-                        text = s.get_text(separator=' ', strip=True)
-                        # Remove unnecessary whitespaces and colons
-                        text = re.sub(r'\s+', ' ', text)
-                        text = text.replace('‎', '').replace('‏', '').strip()
-                        if ':' in text:
-                            key_value = text.split(':', 1)
-                            key = key_value[0].strip()
-                            value = key_value[1].strip()
-                            description_dict[key] = value
-                        else:
-                            # Handle cases where key and value are not separated by colon
-                            parts = text.split()
-                            if len(parts) >= 2:
-                                key = parts[0].strip()
-                                value = ' '.join(parts[1:]).strip()
-                                description_dict[key] = value
-            book_info['Description'] = description_dict
-
-            # 4. Get authors and illustrators
-            authors = []
-            illustrators = []
-
-            byline_info = soup.find('div', {'id': 'bylineInfo'})
-            if byline_info:
-                contributors = byline_info.find_all('span', {'class': 'author'})
-                for contributor in contributors:
-                    name_tag = contributor.find('a', {'class': 'a-link-normal'})
-                    role_tag = contributor.find('span', {'class': 'contribution'})
-                    if name_tag and role_tag:
-                        name = name_tag.get_text(strip=True)
-                        role_text = role_tag.get_text(strip=True)
-                        if '(著)' in role_text or 'Author' in role_text:
-                            authors.append(name)
-                        elif '(イラスト)' in role_text or 'Illustrator' in role_text:
-                            illustrators.append(name)
-                        else:
-                            # Default to authors if role is unspecified
-                            authors.append(name)
-
-            # Remove duplicates
-            authors = list(set(authors))
-            illustrators = list(set(illustrators))
-
-            # 5. Get preface (if any)
-            preface = ''
-            # Assuming the preface is in a <span> with no id or class
-            book_description_div = soup.find('div', {'id': 'bookDescription_feature_div'})
-            if book_description_div:
-                spans = book_description_div.find_all('span')
-                for span in spans:
-                    # Exclude spans with id or class
-                    if not span.get('id') and not span.get('class'):
-                        preface = span.get_text(separator='\n').strip()
-                        break  # Assuming the first such span is the preface
-            book_info['Preface'] = preface
-
-            book_info['Authors'] = authors
-            book_info['Illustrators'] = illustrators
-            book_info['ASIN'] = asin  # Add ASIN to book_info
-
-            # Book info successfully retrieved
-            return book_info
+                    # Handle cases where key and value are not separated by colon
+                    parts = text.split()
+                    if len(parts) >= 2:
+                        key = parts[0].strip()
+                        value = ' '.join(parts[1:]).strip()
+                        description_dict[sys.intern(key)] = value
+    book_info.description = description_dict
+
+    # 4. Get authors and illustrators
+    authors = []
+    illustrators = []
+
+    byline_info = soup.find('div', {'id': 'bylineInfo'})
+    if byline_info:
+        contributors = byline_info.find_all('span', {'class': 'author'})
+        for contributor in contributors:
+            name_tag = contributor.find('a', {'class': 'a-link-normal'})
+            role_tag = contributor.find('span', {'class': 'contribution'})
+            if name_tag and role_tag:
+                name = sys.intern(name_tag.get_text(strip=True))
+                role_text = role_tag.get_text(strip=True)
+                if '(著)' in role_text or 'Author' in role_text:
+                    authors.append(name)
+                elif '(イラスト)' in role_text or 'Illustrator' in role_text:
+                    illustrators.append(name)
+                else:
+                    # Default to authors if role is unspecified
+                    authors.append(name)
+
+    # Remove duplicates
+    authors = list(set(authors))
+    illustrators = list(set(illustrators))
+
+    # 5. Get preface (if any)
+    preface = ''
+    # Assuming the preface is in a <span> with no id or class
+    book_description_div = soup.find('div', {'id': 'bookDescription_feature_div'})
+    if book_description_div:
+        spans = book_description_div.find_all('span')
+        for span in spans:
+            # Exclude spans with id or class
+            if not span.get('id') and not span.get('class'):
+                preface = span.get_text(separator='\n').strip()
+                break  # Assuming the first such span is the preface
+    book_info.preface = preface
+
+    book_info.authors = authors
+    book_info.illustrators = illustrators
+
+    return book_info
+
+# Fields a book record needs before it counts as complete
+critical_fields = ['Authors', 'Illustrators', 'Description', 'Preface']
+
+class MergedBookInfo(object):
+    # Collects the fields of one book over every page fetched for it (both URL
+    # variants and every retry). Each field keeps the first non-empty value seen,
+    # so one page's language is never mixed into another's. A field that keeps
+    # coming back empty from real product pages is treated as genuinely absent.
+    __slots__ = ('asin', 'book_info', 'empty_counts', 'attempts')
+    absent_after = 2
+
+    def __init__(self, asin, book_info=None):
+        self.asin = asin
+        self.book_info = None
+        self.empty_counts = {field: 0 for field in critical_fields}
+        # Calls to books_info_flow() for this book
+        self.attempts = 0
+        if book_info:
+            self.book_info = book_info.copy()
+
+    def add(self, book_info):
+        if not book_info:
+            return
+        if self.book_info is None:
+            self.book_info = book_info.copy()
+        else:
+            for field, value in book_info.items():
+                if value and not self.book_info.get(field):
+                    self.book_info[field] = value
+
+        # A page without a title is not a real product page (e.g. a robot check)
+        if not book_info.get('Title'):
+            return
+        for field in critical_fields:
+            if not book_info.get(field):
+                self.empty_counts[field] += 1
+        if book_info.get('Authors') and not book_info.get('Illustrators'):
+            # The byline was rendered and lists no illustrator: the book has none
+            self.empty_counts['Illustrators'] = self.absent_after
+
+    def add_complete(self, book_info):
+        # A record that already counted as complete, e.g. from another crawl:
+        # its empty fields are known to be absent
+        self.add(book_info)
+        for field in critical_fields:
+            if not book_info.get(field):
+                self.empty_counts[field] = self.absent_after
+
+    def missing_fields(self):
+        book_info = self.book_info or {}
+        return [field for field in critical_fields if not book_info.get(field) and self.empty_counts[field] < self.absent_after]
+
+    def is_complete(self):
+        return self.book_info is not None and not self.missing_fields()
+
+    def start_attempt(self):
+        # Whether this attempt may use cached pages. A book that came back
+        # incomplete before, in this run or an earlier one, is fetched past
+        # the cache, which would only hand out the same pages again.
+        use_cache = not self.attempts and self.book_info is None
+        self.attempts += 1
+        return use_cache
+
+@timed_stage('product')
+def books_info_flow(base_url, asin, headers=None, merged=None):
+    # Fields found by earlier attempts are kept; this call only fills the gaps
+    if merged is None:
+        merged = MergedBookInfo(asin)
+
+    use_cache = merged.start_attempt()
+
+    last_exception = None
+    response = None  # Initialize response
+
+    for url in book_page_urls(base_url, asin):
+        try:
+            response = yield ('get', url, headers, 'product', use_cache, True)
+            if response.status_code != 200:
+                print(f"Received status code {response.status_code} for URL {url}")
+                continue
+
+            book_info = yield ('parse', parse_book_page, response.text, asin)
+            if getattr(response, 'truncated', False) and not book_info.get('Title'):
+                # The cut-off page did not parse as expected; download it whole
+                metrics.count('product_refetches')
+                response = yield ('get', url, headers, 'product', False)
+                if response.status_code != 200:
+                    print(f"Received status code {response.status_code} for URL {url}")
+                    continue
+                book_info = yield ('parse', parse_book_page, response.text, asin)
+            if not book_info.get('Title'):
+                yield ('forget', url)
+
+            merged.add(book_info)
+            # Only try the other URL variant for fields that are still missing
+            if merged.is_complete():
+                return merged.book_info
 
         except requests.exceptions.RequestException as e:
             last_exception = e
@@ -420,16 +1965,76 @@ def get_books_info(base_url, asin, headers=None):
             continue
         except Exception as e:
             last_exception = e
-            print(f"An error occurred while processing URL {url}: {e}")
+            # repr(), since a timeout's message is empty
+            print(f"An error occurred while processing URL {url}: {e!r}")
             continue
 
+    if merged.book_info is not None:
+        # A partial record; the caller decides whether to retry the missing fields
+        return merged.book_info
+
     # If all attempts fail, provide detailed error info
-    print(f"Failed to retrieve book info for ASIN {asin}. Last error: {last_exception}")
-    # Print the response content if available
+    print(f"Failed to retrieve book info for ASIN {asin}. Last error: {last_exception!r}")
+    # Show the start of the last page, not all of it
     if response:
-        print(f"Response content for ASIN {asin}:\n{response.text}")
+        print(f"Response content for ASIN {asin} ({len(response.text)} characters):\n{response.text[:500]}")
     return None
 
+def get_books_info(base_url, asin, headers=None, session=None, merged=None):
+    if session is None:
+        session = create_session()
+    return SessionTransport(session).run(books_info_flow(base_url, asin, headers, merged))
+
+def stored_book(asin, merged):
+    # A complete record collected earlier in this run, merged into merged
+    book_info = book_store.lookup(asin)
+    if book_info is None:
+        return None
+    merged.add_complete(book_info)
+    return merged.book_info
+
+def shared_book_result(merged, result, shared):
+    # Settle a single-flight book fetch: (book_info, complete) from whoever
+    # ran it. A caller that waited on another's fetch merges the result.
+    book_info, complete = result
+    if shared:
+        if book_info is not None:
+            (merged.add_complete if complete else merged.add)(book_info)
+        return merged.book_info
+    if complete:
+        book_store.add(book_info)
+    return book_info
+
+def completed_books_info_flow(base_url, asin, headers, merged):
+    # (book_info, complete), for shared_book_result()
+    book_info = yield from books_info_flow(base_url, asin, headers, merged)
+    return book_info, merged.is_complete()
+
+def shared_book_info_flow(base_url, asin, headers=None, merged=None):
+    # books_info_flow() for crawls that may meet an ASIN more than once: a
+    # book collected earlier in this run is reused, and concurrent fetches of
+    # one ASIN share a single fetch
+    if merged is None:
+        merged = MergedBookInfo(asin)
+    book_info = stored_book(asin, merged)
+    if book_info is not None:
+        return book_info
+    result, shared = yield ('coalesce', ('book', asin), completed_books_info_flow(base_url, asin, headers, merged))
+    return shared_book_result(merged, result, shared)
+
+def indexed_book_flow(base_url, asins, idx, is_running, merged_books):
+    # (idx, book_info) for one book of a series fetch
+    # Skip work that was still queued when the user pressed Stop
+    if not is_running():
+        return idx, None
+    headers = {"User-Agent": random.choice(user_agents_list)}
+    return idx, (yield from shared_book_info_flow(base_url, asins[idx], headers, merged_books[asins[idx]]))
+
+def fetch_book_info(base_url, asin, headers=None, session=None, merged=None):
+    if session is None:
+        session = create_session()
+    return SessionTransport(session).run(shared_book_info_flow(base_url, asin, headers, merged))
+
 def print_series_info(series_info):
     print("\nSeries Information:")
     print("-------------------")
@@ -465,28 +2070,9 @@ def print_book_info(book_info):
     print(book_info.get('Preface', 'N/A'))
     print("\n\n")  # Added two newlines at the end
 
-def export_to_html(series_info, books_info_list, base_url, single_book=False):
-    # Ensure the /output directory exists
-    output_dir = 'output'
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    # Determine the filename
-    if single_book:
-        if books_info_list and books_info_list[0]:
-            title = books_info_list[0].get('Title', 'book_info')
-        else:
-            title = 'book_info'
-    else:
-        title = series_info.get('Series Title', 'series_info')
-
-    sanitized_title = sanitize_filename(title)
-    filename = f"{sanitized_title}.html"
-    file_path = os.path.join(output_dir, filename)
-
-    # Use Jinja2 template for HTML export
-    env = Environment()
-    template_string = """
+# The export page. The header, book and footer blocks can also be rendered on
+# their own, which is how StreamingExport writes a page while the crawl runs.
+export_template_string = """{% block header %}
     <!DOCTYPE html>
     <html>
     <head>
@@ -520,7 +2106,7 @@ def export_to_html(series_info, books_info_list, base_url, single_book=False):
         </ul>
         {% endif %}
         <h2>{{ 'Book' if single_book else 'Books' }}</h2>
-        {% for book in books %}
+        {% endblock %}{% for book in books %}{% block book scoped %}
         <div class="book">
             <h3><a href="{{ base_url }}/dp/{{ book['ASIN'] }}" target="_blank">{{ book['Title'] }}</a></h3>
             <img src="{{ book['thumbnail'] }}" alt="{{ book['Title'] }}">
@@ -535,155 +2121,2153 @@ def export_to_html(series_info, books_info_list, base_url, single_book=False):
             <p><strong>Preface:</strong><br>{{ book['Preface'] | nl2br }}</p>
             <p><strong>Large Image:</strong> <a href="{{ book['largeImage'] }}" target="_blank">{{ book['largeImage'] }}</a></p>
         </div>
-        {% endfor %}
+        {% endblock %}{% endfor %}{% block footer %}
     </body>
     </html>
-    """
+    {% endblock %}"""
+
+@functools.lru_cache(maxsize=None)
+def get_export_template():
+    # Compiled once per process
+    env = Environment()
     env.filters['nl2br'] = lambda text: text.replace('\n', '<br>') if text else ''
-    template = env.from_string(template_string)
+    return env.from_string(export_template_string)
+
+def export_file_path(series_info, books_info_list, single_book, extension='html'):
+    # Ensure the /output directory exists
+    output_dir = 'output'
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # Determine the filename
+    if single_book:
+        if books_info_list and books_info_list[0]:
+            title = books_info_list[0].get('Title', 'book_info')
+        else:
+            title = 'book_info'
+    else:
+        title = series_info.get('Series Title', 'series_info')
+
+    sanitized_title = sanitize_filename(title)
+    filename = f"{sanitized_title}.{extension}"
+    return os.path.join(output_dir, filename)
+
+def render_export(series_info, books_info_list, base_url, single_book=False, images=None):
+    # The export page as a stream of chunks. images maps remote image URLs to
+    # local files to show instead.
+    template = get_export_template()
 
-    # Filter out None entries in books_info_list
-    valid_books_info = [book for book in books_info_list if book]
+    # Filter out None entries in books_info_list. Books are rendered as they
+    # are read, so books_info_list may be a generator.
+    valid_books_info = (localize_images(book, images, ('thumbnail', 'largeImage')) for book in books_info_list if book)
+    if single_book:
+        # The page title is the first book's
+        valid_books_info = list(valid_books_info)
+    series_info = localize_images(series_info, images, ('Series Image URL',))
+    return template.generate(series=series_info, books=valid_books_info, base_url=base_url, single_book=single_book)
 
-    rendered_html = template.render(series=series_info, books=valid_books_info, base_url=base_url, single_book=single_book)
+@timed_stage('export')
+def export_to_html(series_info, books_info_list, base_url, single_book=False, images=None):
+    file_path = export_file_path(series_info, books_info_list, single_book)
 
-    with open(file_path, 'w', encoding='utf-8') as f:
-        f.write(rendered_html)
+    # Stream the page into a temporary file and swap it in, so an existing
+    # export is never left half-written
+    temp_path = file_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        for chunk in render_export(series_info, books_info_list, base_url, single_book, images):
+            f.write(chunk)
+    os.replace(temp_path, file_path)
 
     print(f"Exported data to {file_path}")
 
+def partial_export_path(path):
+    root, extension = os.path.splitext(path)
+    return f"{root}.partial{extension}"
+
+class StreamingExport(object):
+    # Writes a series export while it is being crawled: every finished book is
+    # appended to a JSONL sidecar and to the HTML page straight away, so both
+    # files are usable at any moment. Both are written under .partial names,
+    # listing books in the order they finished. finish() renders the page in
+    # series order from the sidecar and moves the files into place, so an
+    # earlier export is only ever replaced by a complete one.
+    def __init__(self, series_info, base_url):
+        self.series_info = series_info
+        self.base_url = base_url
+        self.template = get_export_template()
+        self.html_path = export_file_path(series_info, None, False)
+        self.jsonl_path = export_file_path(series_info, None, False, extension='jsonl')
+        self.partial_html_path = partial_export_path(self.html_path)
+        self.partial_jsonl_path = partial_export_path(self.jsonl_path)
+        self.jsonl_file = open(self.partial_jsonl_path, 'w', encoding='utf-8')
+        self.html_file = open(self.partial_html_path, 'w', encoding='utf-8')
+        self.write_block('header', series=series_info, single_book=False)
+
+    def write_block(self, name, **context):
+        context = self.template.new_context(dict(context, base_url=self.base_url))
+        for chunk in self.template.blocks[name](context):
+            self.html_file.write(chunk)
+        self.html_file.flush()
+
+    def add(self, idx, book_info):
+        if not book_info:
+            return
+        self.jsonl_file.write(json.dumps(dict(book_info.to_dict(), index=idx), ensure_ascii=False) + '\n')
+        self.jsonl_file.flush()
+        self.write_block('book', book=book_info)
+
+    def finish(self, images=None):
+        self.jsonl_file.close()
+        self.html_file.close()
+        # Series order from the sidecar: only each book's offset is kept in
+        # memory, and the books are read back one at a time while rendering
+        offsets = {}
+        with open(self.partial_jsonl_path, 'rb') as f:
+            offset = 0
+            for line in f:
+                offsets[json.loads(line)['index']] = offset
+                offset += len(line)
+
+        def books_in_order():
+            with open(self.partial_jsonl_path, 'rb') as f:
+                for idx in sorted(offsets):
+                    f.seek(offsets[idx])
+                    yield Book.from_dict(json.loads(f.readline()))
+
+        export_to_html(self.series_info, books_in_order(), self.base_url, images=images)
+        os.replace(self.partial_jsonl_path, self.jsonl_path)
+        os.remove(self.partial_html_path)
+
+    def close(self):
+        # Leave the partial page valid HTML when the crawl ends early; the
+        # last complete export stays as it was
+        if not self.html_file.closed:
+            self.write_block('footer')
+            self.html_file.close()
+        self.jsonl_file.close()
+        print(f"The books collected so far are in {self.partial_html_path} and {self.partial_jsonl_path}.")
+
+publication_date_keys = ('発売日', 'Publication date', '出版社', 'Publisher')
+
+def normalize_publication_date(description):
+    # 'YYYY-MM-DD' from the detail bullets, which give '2023/1/24',
+    # 'January 24, 2023' or a date in brackets after the publisher
+    for key in publication_date_keys:
+        value = description.get(key) if description else None
+        if not value:
+            continue
+        match = re.search(r'(\d{4})\s*[/\-年.]\s*(\d{1,2})\s*[/\-月.]\s*(\d{1,2})', value)
+        if match:
+            return '{:04d}-{:02d}-{:02d}'.format(*map(int, match.groups()))
+        match = re.search(r'([A-Z][a-z]+) (\d{1,2}), (\d{4})', value)
+        if match:
+            try:
+                return time.strftime('%Y-%m-%d', time.strptime(' '.join(match.groups()), '%B %d %Y'))
+            except ValueError:
+                pass
+    return None
+
+def normalize_title(title):
+    # Full-width and half-width forms fold together; spacing and punctuation are dropped
+    return re.sub(r'[\W_]+', '', unicodedata.normalize('NFKC', title)).casefold()
+
+def title_grams(title):
+    # Character bigrams, which suit Japanese titles that have no word breaks.
+    # The ends are marked and repeated bigrams numbered, so that '77' and '777'
+    # or a title and its reversal do not share every bigram.
+    normalized = normalize_title(title)
+    if not normalized:
+        return set()
+    padded = f"^{normalized}$"
+    grams = set()
+    seen = {}
+    for i in range(len(padded) - 1):
+        gram = padded[i:i + 2]
+        seen[gram] = seen.get(gram, 0) + 1
+        grams.add(gram if seen[gram] == 1 else f"{gram}{seen[gram]}")
+    return grams
+
+def person_key(name):
+    # People are matched ignoring case and spacing, which varies between pages
+    return re.sub(r'\s+', '', name).casefold()
+
+class Catalog(object):
+    # Normalized SQLite store of every crawled series and book, for lookups
+    # across the whole catalog. Each series is written in one transaction.
+    # Series and book titles are also indexed as character bigrams, so that a
+    # query can be matched to a known series without searching the site.
+    def __init__(self, path, title_min_score=0.8):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.title_min_score = title_min_score
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS series (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL UNIQUE,
+                title TEXT,
+                image_url TEXT,
+                description TEXT,
+                updated_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS books (
+                asin TEXT PRIMARY KEY,
+                title TEXT,
+                publisher TEXT,
+                publication_date TEXT,
+                thumbnail TEXT,
+                large_image TEXT,
+                preface TEXT,
+                details TEXT,
+                updated_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS series_books (
+                series_id INTEGER NOT NULL REFERENCES series (id) ON DELETE CASCADE,
+                asin TEXT NOT NULL REFERENCES books (asin) ON DELETE CASCADE,
+                position INTEGER NOT NULL,
+                PRIMARY KEY (series_id, asin)
+            );
+            CREATE TABLE IF NOT EXISTS people (
+                id INTEGER PRIMARY KEY,
+                key TEXT NOT NULL UNIQUE,
+                name TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS book_people (
+                asin TEXT NOT NULL REFERENCES books (asin) ON DELETE CASCADE,
+                person_id INTEGER NOT NULL REFERENCES people (id),
+                role TEXT NOT NULL,
+                PRIMARY KEY (asin, role, person_id)
+            );
+            CREATE TABLE IF NOT EXISTS series_people (
+                series_id INTEGER NOT NULL REFERENCES series (id) ON DELETE CASCADE,
+                person_id INTEGER NOT NULL REFERENCES people (id),
+                role TEXT NOT NULL,
+                PRIMARY KEY (series_id, role, person_id)
+            );
+            CREATE TABLE IF NOT EXISTS titles (
+                id INTEGER PRIMARY KEY,
+                series_id INTEGER NOT NULL REFERENCES series (id) ON DELETE CASCADE,
+                title TEXT NOT NULL,
+                gram_count INTEGER NOT NULL,
+                UNIQUE (series_id, title)
+            );
+            CREATE TABLE IF NOT EXISTS title_grams (
+                gram TEXT NOT NULL,
+                title_id INTEGER NOT NULL REFERENCES titles (id) ON DELETE CASCADE,
+                PRIMARY KEY (gram, title_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS series_title ON series (title);
+            CREATE INDEX IF NOT EXISTS title_grams_title ON title_grams (title_id);
+            CREATE INDEX IF NOT EXISTS books_title ON books (title);
+            CREATE INDEX IF NOT EXISTS books_publication_date ON books (publication_date);
+            CREATE INDEX IF NOT EXISTS series_books_asin ON series_books (asin);
+            CREATE INDEX IF NOT EXISTS book_people_person ON book_people (person_id, role);
+            CREATE INDEX IF NOT EXISTS series_people_person ON series_people (person_id, role);
+        """)
+        self.db.commit()
+        # Catalogs written before the title index existed get one now
+        if not self.db.execute("SELECT 1 FROM titles LIMIT 1").fetchone() and self.db.execute("SELECT 1 FROM series LIMIT 1").fetchone():
+            self.rebuild_title_index()
+
+    def index_titles(self, series_id, titles):
+        self.db.execute("DELETE FROM titles WHERE series_id = ?", (series_id,))
+        for title in dict.fromkeys(title for title in titles if title):
+            grams = title_grams(title)
+            if not grams:
+                continue
+            title_id = self.db.execute(
+                "INSERT INTO titles (series_id, title, gram_count) VALUES (?, ?, ?)", (series_id, title, len(grams))).lastrowid
+            self.db.executemany("INSERT INTO title_grams (gram, title_id) VALUES (?, ?)", [(gram, title_id) for gram in grams])
+
+    def rebuild_title_index(self):
+        with self.lock, self.db:
+            for series_id, series_title in self.db.execute("SELECT id, title FROM series").fetchall():
+                book_titles = [row[0] for row in self.db.execute(
+                    "SELECT books.title FROM series_books JOIN books ON books.asin = series_books.asin "
+                    "WHERE series_books.series_id = ? ORDER BY series_books.position", (series_id,))]
+                self.index_titles(series_id, [series_title] + book_titles)
+
+    def match_titles(self, query, limit=20):
+        # Series and book titles sharing the most n-grams with the query, scored
+        # by the Dice coefficient of the two n-gram sets. Returns items shaped
+        # like search results, best first.
+        grams = title_grams(query)
+        if not grams:
+            return []
+        placeholders = ', '.join('?' * len(grams))
+        with self.lock:
+            rows = self.db.execute(f"""
+                SELECT titles.title, titles.gram_count, series.url, matches.shared
+                FROM (SELECT title_id, COUNT(*) AS shared FROM title_grams WHERE gram IN ({placeholders})
+                      GROUP BY title_id ORDER BY shared DESC LIMIT ?) AS matches
+                JOIN titles ON titles.id = matches.title_id
+                JOIN series ON series.id = titles.series_id""", tuple(grams) + (limit * 5,)).fetchall()
+        items = [
+            {'alt_text': title, 'series_link': url, 'similarity': 2.0 * shared / (len(grams) + gram_count)}
+            for title, gram_count, url, shared in rows
+        ]
+        items.sort(key=lambda item: item['similarity'], reverse=True)
+        return items[:limit]
+
+    def person_ids(self, names):
+        ids = []
+        for name in names or []:
+            key = person_key(name)
+            if not key:
+                continue
+            self.db.execute("INSERT OR IGNORE INTO people (key, name) VALUES (?, ?)", (key, name))
+            ids.append(self.db.execute("SELECT id FROM people WHERE key = ?", (key,)).fetchone()[0])
+        return ids
+
+    def upsert_book(self, book_info, now):
+        description = book_info.get('Description') or {}
+        publisher = description.get('出版社') or description.get('Publisher')
+        if publisher:
+            # '出版社 : KADOKAWA (2023/1/24)' also carries the date
+            publisher = re.sub(r'\s*[(（][^)）]*[)）]\s*$', '', publisher)
+        self.db.execute("""
+            INSERT INTO books (asin, title, publisher, publication_date, thumbnail, large_image, preface, details, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (asin) DO UPDATE SET
+                title = excluded.title, publisher = excluded.publisher, publication_date = excluded.publication_date,
+                thumbnail = excluded.thumbnail, large_image = excluded.large_image, preface = excluded.preface,
+                details = excluded.details, updated_at = excluded.updated_at""",
+            (book_info['ASIN'], book_info.get('Title'), publisher, normalize_publication_date(description),
+             book_info.get('thumbnail'), book_info.get('largeImage'), book_info.get('Preface'),
+             json.dumps(description, ensure_ascii=False), now))
+        self.db.execute("DELETE FROM book_people WHERE asin = ?", (book_info['ASIN'],))
+        for role, names in (('author', book_info.get('Authors')), ('illustrator', book_info.get('Illustrators'))):
+            self.db.executemany(
+                "INSERT OR IGNORE INTO book_people (asin, person_id, role) VALUES (?, ?, ?)",
+                [(book_info['ASIN'], person_id, role) for person_id in self.person_ids(names)])
+
+    def upsert_series(self, series_url, series_info, books_info_list):
+        # Replace what the catalog knows about one series and its books.
+        # Books without a record are left out; their earlier rows are kept.
+        now = time.time()
+        books = [(position, book) for position, book in enumerate(books_info_list) if book and book.get('ASIN')]
+        with self.lock, self.db:
+            series_id = None
+            if series_url:
+                series_key = series_manifest_key(series_url)
+                self.db.execute("""
+                    INSERT INTO series (url, title, image_url, description, updated_at) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (url) DO UPDATE SET
+                        title = excluded.title, image_url = excluded.image_url,
+                        description = excluded.description, updated_at = excluded.updated_at""",
+                    (series_key, series_info.get('Series Title'), series_info.get('Series Image URL'),
+                     series_info.get('Series Description'), now))
+                series_id = self.db.execute("SELECT id FROM series WHERE url = ?", (series_key,)).fetchone()[0]
+                self.db.execute("DELETE FROM series_people WHERE series_id = ?", (series_id,))
+                for role, names in (('author', series_info.get('Authors')), ('illustrator', series_info.get('Illustrators'))):
+                    self.db.executemany(
+                        "INSERT OR IGNORE INTO series_people (series_id, person_id, role) VALUES (?, ?, ?)",
+                        [(series_id, person_id, role) for person_id in self.person_ids(names)])
+                self.index_titles(series_id, [series_info.get('Series Title')] + [book_info.get('Title') for position, book_info in books])
+            for position, book_info in books:
+                self.upsert_book(book_info, now)
+            if series_id is not None:
+                self.db.execute("DELETE FROM series_books WHERE series_id = ?", (series_id,))
+                self.db.executemany(
+                    "INSERT INTO series_books (series_id, asin, position) VALUES (?, ?, ?)",
+                    [(series_id, book_info['ASIN'], position) for position, book_info in books])
+        return len(books)
+
+    def find(self, field, value):
+        # Books matching one field, with the series they belong to. 'published'
+        # takes a date prefix ('2023', '2023-01') or a range ('2023-01..2023-06').
+        select = """
+            SELECT books.asin, books.title, books.publication_date, series.title, series_books.position,
+                   (SELECT group_concat(people.name, ', ') FROM book_people JOIN people ON people.id = book_people.person_id
+                    WHERE book_people.asin = books.asin AND book_people.role = 'author'),
+                   (SELECT group_concat(people.name, ', ') FROM book_people JOIN people ON people.id = book_people.person_id
+                    WHERE book_people.asin = books.asin AND book_people.role = 'illustrator')
+            FROM books
+            LEFT JOIN series_books ON series_books.asin = books.asin
+            LEFT JOIN series ON series.id = series_books.series_id
+        """
+        order = " ORDER BY series.title, series_books.position, books.title"
+        if field == 'asin':
+            where, params = "WHERE books.asin = ?", (value.strip().upper(),)
+        elif field in ('author', 'illustrator'):
+            where = ("WHERE books.asin IN (SELECT book_people.asin FROM book_people JOIN people ON people.id = book_people.person_id "
+                     "WHERE people.key = ? AND book_people.role = ?)")
+            params = (person_key(value), field)
+        elif field == 'series':
+            where = ("WHERE books.asin IN (SELECT series_books.asin FROM series JOIN series_books ON series_books.series_id = series.id "
+                     "WHERE series.title = ?) AND series.title = ?")
+            params = (value.strip(), value.strip())
+        elif field == 'published':
+            start, _, end = value.partition('..')
+            end = end or start
+            # A prefix range: '2023-01' covers 2023-01-01 up to 2023-01-99
+            where, params = "WHERE books.publication_date BETWEEN ? AND ?", (start.strip(), end.strip() + '~')
+        else:
+            raise ValueError(f"Unknown catalog field: {field}")
+        with self.lock:
+            return self.db.execute(select + where + order, params).fetchall()
+
+    def counts(self):
+        with self.lock:
+            return {table: self.db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                    for table in ('series', 'books', 'people')}
+
+    def close(self):
+        self.db.close()
+
+def create_title_index(config):
+    # Queries are matched against the catalog's titles before searching the site
+    if not config.get("catalog_enabled", True) or float(config.get("title_index_min_score", 0.8)) > 1:
+        return None
+    return Catalog(config.get("catalog_path", "output/catalog.sqlite"), float(config.get("title_index_min_score", 0.8)))
+
+def find_known_series_link(title_index, search_input):
+    # A series already in the catalog whose title matches the query well
+    # enough, or None to search the site
+    if not title_index or remove_language_parameter(search_input).startswith('http'):
+        return None
+    best_match = prefer_bunko_item(title_index.match_titles(search_input))
+    if best_match and best_match['similarity'] >= title_index.title_min_score:
+        print(f"Found '{best_match['alt_text']}' in the catalog (similarity {best_match['similarity'] * 100:.2f}%).")
+        return best_match['series_link']
+    return None
+
+def create_catalog(config):
+    if not config.get("catalog_enabled", True):
+        return None
+    return Catalog(config.get("catalog_path", "output/catalog.sqlite"))
+
+def add_to_catalog(config, series_url, series_info, books_info_list):
+    catalog = create_catalog(config)
+    if catalog:
+        books_added = catalog.upsert_series(series_url, series_info, books_info_list)
+        print(f"Added {books_added} books to the catalog.")
+        catalog.close()
+
+def run_catalog_query(field, value):
+    config = load_config()
+    catalog = Catalog(config.get("catalog_path", "output/catalog.sqlite"))
+    started = time.perf_counter()
+    rows = catalog.find(field, value)
+    elapsed = time.perf_counter() - started
+    for asin, title, publication_date, series_title, position, authors, illustrators in rows:
+        series_label = f"{series_title} #{position + 1}" if series_title else "(no series)"
+        print(f"{asin}  {publication_date or '----------'}  {series_label}  {title}")
+        print(f"            Authors: {authors or ''}  Illustrators: {illustrators or ''}")
+    print(f"{len(rows)} books in {elapsed * 1000:.1f} ms.")
+    catalog.close()
+
+image_extensions = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/gif': '.gif', 'image/webp': '.webp'}
+
+class ImageStore(object):
+    # Downloaded cover images, each saved under the SHA-256 of its content so
+    # the same picture is kept once whichever URL it came from. An index of
+    # URL -> digest lets a later export reuse a stored image without asking
+    # the site again; cover URLs change whenever the picture does.
+    def __init__(self, directory, thumbnail_width=200):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.thumbnail_width = thumbnail_width
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(directory, 'index.sqlite'), timeout=60, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS images (
+                url TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                extension TEXT NOT NULL,
+                fetched_at REAL
+            )""")
+        self.db.commit()
+        self.downloaded = 0
+        self.reused = 0
+        self.duplicates = 0
+        self.thumbnails = 0
+        self.failed = 0
+
+    def image_path(self, digest, extension, suffix=''):
+        return os.path.join(self.directory, digest[:2], f"{digest}{suffix}{extension}")
+
+    def stored_path(self, url):
+        with self.lock:
+            row = self.db.execute("SELECT digest, extension FROM images WHERE url = ?", (url,)).fetchone()
+        if row:
+            path = self.image_path(*row)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def fetch(self, session, url):
+        # Local path of the image at url, downloading it unless it is stored
+        path = self.stored_path(url)
+        if path:
+            with self.lock:
+                self.reused += 1
+            return path
+        try:
+            response = session.get(url, url_class='image', use_cache=False)
+        except requests.RequestException as e:
+            print(f"Failed to download image {url}: {e}")
+            response = None
+        if response is None or response.status_code != 200 or not response.content:
+            with self.lock:
+                self.failed += 1
+            return None
+
+        content = response.content
+        digest = hashlib.sha256(content).hexdigest()
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        extension = image_extensions.get(content_type) or os.path.splitext(urllib.parse.urlparse(url).path)[1].lower() or '.jpg'
+        path = self.image_path(digest, extension)
+        with self.lock:
+            if os.path.exists(path):
+                self.duplicates += 1
+            else:
+                write_file_atomically(path, content)
+            self.downloaded += 1
+            self.db.execute("INSERT OR REPLACE INTO images (url, digest, extension, fetched_at) VALUES (?, ?, ?, ?)",
+                            (url, digest, extension, time.time()))
+            self.db.commit()
+        return path
+
+    def thumbnail(self, path):
+        # A downscaled copy of a stored image, or None without Pillow
+        if Image is None or not path:
+            return None
+        digest, extension = os.path.splitext(os.path.basename(path))
+        thumbnail_path = self.image_path(digest, '.jpg', f"_w{self.thumbnail_width}")
+        if os.path.exists(thumbnail_path):
+            return thumbnail_path
+        try:
+            with Image.open(path) as image:
+                image.thumbnail((self.thumbnail_width, self.thumbnail_width * 4))
+                temp_path = f"{thumbnail_path}.{threading.get_ident()}.tmp"
+                image.convert('RGB').save(temp_path, 'JPEG', quality=85)
+            os.replace(temp_path, thumbnail_path)
+        except (OSError, ValueError) as e:
+            print(f"Failed to make a thumbnail of {path}: {e}")
+            return None
+        with self.lock:
+            self.thumbnails += 1
+        return thumbnail_path
+
+    def print_stats(self):
+        print(f"Images: {self.downloaded} downloaded ({self.duplicates} already stored under another URL), "
+              f"{self.reused} reused, {self.thumbnails} thumbnails made, {self.failed} failed.")
+
+    def close(self):
+        self.db.close()
+
+def write_file_atomically(path, content):
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+def create_image_session(config):
+    # Covers come from an image host, paced separately from the store pages
+    rate_controller = AdaptiveRateController(
+        float(config.get("image_requests_per_second", 10)),
+        initial_rate=float(config.get("image_requests_per_second", 10)) / 2,
+        min_rate=float(config.get("min_requests_per_second", 0.2))
+    )
+    return CrawlSession(config, rate_controller=rate_controller)
+
+def download_cover_images(config, series_info, books_info_list):
+    # Store the series and book covers locally. Returns {field: {remote URL:
+    # path relative to the output folder}} for the export; empty when
+    # disabled. Product pages often give the same URL for the thumbnail and
+    # the large image, so each field has its own map.
+    if not config.get("download_images", False):
+        return {}
+    store = ImageStore(config.get("image_dir", "output/images"), int(config.get("thumbnail_width", 200)))
+    session = create_image_session(config)
+    books = [book for book in books_info_list if book]
+    large_urls = [url for url in dict.fromkeys([series_info.get('Series Image URL')] + [book.get('largeImage') for book in books]) if url]
+
+    local_paths = {}
+    with ThreadPoolExecutor(max_workers=max(1, int(config.get("image_workers", 8)))) as executor:
+        for url, path in zip(large_urls, executor.map(lambda url: store.fetch(session, url), large_urls)):
+            if path:
+                local_paths[url] = path
+
+        # Thumbnails are made from the large image; without Pillow the site's
+        # own small cover is downloaded instead
+        def local_thumbnail(book):
+            path = store.thumbnail(local_paths.get(book.get('largeImage')))
+            if not path and book.get('thumbnail'):
+                path = store.fetch(session, book['thumbnail'])
+            return book.get('thumbnail'), path
+        thumbnail_paths = {}
+        for url, path in executor.map(local_thumbnail, books):
+            if url and path:
+                thumbnail_paths[url] = path
+
+    store.print_stats()
+    store.close()
+    session.close()
+    large_images = {url: os.path.relpath(path, 'output').replace(os.sep, '/') for url, path in local_paths.items()}
+    thumbnails = {url: os.path.relpath(path, 'output').replace(os.sep, '/') for url, path in thumbnail_paths.items()}
+    return {'Series Image URL': large_images, 'largeImage': large_images, 'thumbnail': thumbnails}
+
+def localize_images(record, images, keys):
+    # A copy of the record pointing at local image files where there are any
+    if not images or not record:
+        return record
+    return record.copy({key: images[key][record[key]] for key in keys if record.get(key) in images.get(key, {})})
+
 class RedirectText(object):
-    def __init__(self, text_widget):
+    # stdout for the crawl thread. Tk widgets may only be touched from the
+    # thread running mainloop, so writes are buffered here and the Tk thread
+    # moves them into the log in one insert every interval_ms, keeping the
+    # last max_lines lines. Other widget updates are queued with call() and
+    # run on the same timer.
+    def __init__(self, text_widget, max_lines=5000, interval_ms=100):
         self.text_widget = text_widget
+        self.max_lines = max_lines
+        self.interval_ms = interval_ms
+        self.lock = threading.Lock()
+        self.pending = []
+        self.calls = queue.SimpleQueue()
+        self.text_widget.after(self.interval_ms, self.drain)
 
     def write(self, string):
-        def append():
-            self.text_widget.insert(END, string)
-            self.text_widget.see(END)
-        self.text_widget.after(0, append)
+        with self.lock:
+            self.pending.append(string)
 
     def flush(self):
         pass
 
-def run_application(search_input, log_text_widget, progress_bar, submit_button, redirect_text):
-    # Set sys.stdout to redirect_text inside the thread
-    sys.stdout = redirect_text
+    def call(self, function):
+        # Run function() on the Tk thread
+        self.calls.put(function)
+
+    def clear(self):
+        # Only from the Tk thread
+        with self.lock:
+            self.pending = []
+        self.text_widget.delete('1.0', 'end')
 
-    base_url = generate_config()
-    series_link = get_series_link(base_url, search_input)
-    if series_link:
-        series_info = get_series_info(series_link, base_url)
-        if series_info.get('Books ASINs'):
-            print_series_info(series_info)
-            books_info_list = [None] * len(series_info.get('Books ASINs', []))
-            failed_indices = []
-            retry_counts = {}
-            max_retries = 5  # Increased max retries to 5
-            delay = 1  # Initial delay in seconds
-
-            total_books = len(series_info.get('Books ASINs', []))
-            completed_books = 0
-
-            # Update progress bar maximum
-            progress_bar['maximum'] = total_books
-
-            # First attempt
-            for idx, asin in enumerate(series_info.get('Books ASINs', [])):
-                if not submit_button.running:
-                    print("Process stopped by user.")
+    def drain(self):
+        # Always schedules the next drain, so one failing update cannot stop
+        # the log and every later widget update
+        try:
+            with self.lock:
+                text = ''.join(self.pending)
+                self.pending = []
+            if text:
+                self.text_widget.insert('end', text)
+                lines = int(self.text_widget.index('end-1c').split('.')[0])
+                if lines > self.max_lines:
+                    self.text_widget.delete('1.0', f"{lines - self.max_lines + 1}.0")
+                self.text_widget.see('end')
+            while True:
+                try:
+                    function = self.calls.get_nowait()
+                except queue.Empty:
                     break
-                time.sleep(delay)  # Add delay before running get_books_info
-                headers = {"User-Agent": random.choice(user_agents_list)}
-                book_info = get_books_info(base_url, asin, headers=headers)
-                # Check if critical fields are empty
-                critical_fields = ['Authors', 'Illustrators', 'Description', 'Preface']
-                is_incomplete = any(not book_info.get(field) for field in critical_fields) if book_info else True
-                if book_info and not is_incomplete:
-                    books_info_list[idx] = book_info
-                    print_book_info(book_info)
-                else:
-                    failed_indices.append(idx)
-                    retry_counts[asin] = 1
-                    if is_incomplete:
-                        print(f"Book info incomplete for ASIN {asin}. Missing critical fields. Will retry later.")
-                    else:
-                        print(f"Failed to get info for ASIN {asin}. Will retry later.")
-                completed_books += 1
-                progress_bar['value'] = completed_books
-                progress_bar.update()
-
-            # Retry loop with adaptive delay and random user-agent
-            while failed_indices and submit_button.running:
-                print("Retrying failed ASINs...")
-                time.sleep(delay)  # Delay before starting retries
-                new_failed_indices = []
-                for idx in failed_indices:
-                    if not submit_button.running:
-                        print("Process stopped by user.")
+                try:
+                    function()
+                except Exception as e:
+                    # Shown in the log on the next drain
+                    print(f"A window update failed: {e!r}")
+        finally:
+            self.text_widget.after(self.interval_ms, self.drain)
+
+def completed_fetches(start, indices, max_pending):
+    # Call start(idx), which returns a future, for every index and yield the
+    # results in completion order. indices is read on a thread of its own and
+    # may wait for series pages that are still being fetched, so books are
+    # fetched while the series is being listed. At most max_pending fetches
+    # are started ahead of the ones that finished.
+    results = queue.SimpleQueue()
+    slots = threading.Semaphore(max_pending)
+    stopped = threading.Event()
+    futures = set()
+
+    def finished(future):
+        futures.discard(future)
+        slots.release()
+        results.put(future)
+
+    def feed():
+        started = 0
+        try:
+            for idx in indices:
+                while not slots.acquire(timeout=0.1):
+                    if stopped.is_set():
+                        return
+                if stopped.is_set():
+                    return
+                future = start(idx)
+                futures.add(future)
+                future.add_done_callback(finished)
+                started += 1
+        except Exception as e:
+            results.put(e)
+        finally:
+            # Tells the reader how many results to expect
+            results.put(started)
+
+    threading.Thread(target=feed, daemon=True).start()
+    expected = None
+    received = 0
+    try:
+        while expected is None or received < expected:
+            item = results.get()
+            if isinstance(item, Exception):
+                raise item
+            if isinstance(item, int):
+                expected = item
+                continue
+            received += 1
+            yield item.result()
+    finally:
+        # Drop fetches that have not started if the caller stopped early
+        stopped.set()
+        for future in list(futures):
+            future.cancel()
+
+class RetryPolicy(object):
+    # How often and how patiently failed books and series pages are tried again
+    def __init__(self):
+        self.configure({})
+
+    def configure(self, config):
+        self.max_attempts = max(1, int(config.get("retry_max_attempts", 5)))
+        self.base_delay = float(config.get("retry_base_seconds", 1))
+        self.max_delay = float(config.get("retry_max_seconds", 60))
+        self.deadline_seconds = float(config.get("crawl_deadline_seconds", 0))
+
+    def delay(self, attempt):
+        # Exponential backoff with jitter, so items that failed together do
+        # not all come back at the same moment
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(delay / 2, delay)
+
+    def deadline(self, started):
+        return started + self.deadline_seconds if self.deadline_seconds > 0 else None
+
+    def backoff(self, attempt, deadline):
+        # The wait before the next attempt, or None when the item should be
+        # given up: out of attempts, or the wait would pass the deadline
+        if attempt >= self.max_attempts:
+            return None
+        delay = self.delay(attempt)
+        if deadline is not None and time.monotonic() + delay > deadline:
+            return None
+        return delay
+
+retry_policy = RetryPolicy()
+
+class RetryScheduler(object):
+    # Work for a fetch pipeline, handed out in the order it becomes due. New
+    # items are due at once. A failed item comes back after a backoff of its
+    # own (see RetryPolicy), so one stubborn book does not hold up the others.
+    # Retries that would fall after the deadline (a time.monotonic() value)
+    # are refused. Iterating ends once close() was called and no item is
+    # waiting or being fetched, or early when is_running() turns false or the
+    # deadline passes; expired tells the last two apart.
+    # Seconds between is_running() checks while nothing is due
+    poll_seconds = 0.25
+
+    def __init__(self, policy, deadline=None, is_running=lambda: True):
+        self.policy = policy
+        self.deadline = deadline
+        self.is_running = is_running
+        self.condition = threading.Condition()
+        # (due time, order added, item)
+        self.heap = []
+        self.added = 0
+        # Items handed out and not yet reported back with done() or retry()
+        self.outstanding = 0
+        self.closed = False
+        self.cancelled = False
+        self.expired = False
+        self.error = None
+
+    def push(self, item, due):
+        with self.condition:
+            heapq.heappush(self.heap, (due, self.added, item))
+            self.added += 1
+            self.condition.notify_all()
+
+    def add(self, item):
+        self.push(item, time.monotonic())
+
+    def retry(self, item, attempt):
+        # Schedule another try after the item's backoff. Returns the backoff
+        # in seconds, or None when the item is given up instead.
+        delay = self.policy.backoff(attempt, self.deadline)
+        with self.condition:
+            # Back in the heap before it stops counting as outstanding, or
+            # __iter__ could see no work left and end without the retry
+            if delay is not None:
+                heapq.heappush(self.heap, (time.monotonic() + delay, self.added, item))
+                self.added += 1
+            self.outstanding -= 1
+            self.condition.notify_all()
+        return delay
+
+    def done(self, item):
+        with self.condition:
+            self.outstanding -= 1
+            self.condition.notify_all()
+
+    def close(self, error=None):
+        # No new items will be added
+        with self.condition:
+            self.closed = True
+            self.error = error
+            self.condition.notify_all()
+
+    def cancel(self):
+        with self.condition:
+            self.cancelled = True
+            self.condition.notify_all()
+
+    def pending(self):
+        with self.condition:
+            return [item for _, _, item in self.heap]
+
+    def __iter__(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.cancelled or not self.is_running():
+                        return
+                    if self.error is not None:
+                        raise self.error
+                    now = time.monotonic()
+                    if self.deadline is not None and now >= self.deadline:
+                        self.expired = True
+                        return
+                    if self.heap and self.heap[0][0] <= now:
+                        item = heapq.heappop(self.heap)[2]
+                        self.outstanding += 1
                         break
-                    asin = series_info['Books ASINs'][idx]
-                    retries = retry_counts.get(asin, 1)
-                    if retries >= max_retries:
-                        print(f"Max retries reached for ASIN {asin}. Skipping.")
-                        continue
-                    time.sleep(delay)  # Add delay before retry
-                    headers = {"User-Agent": random.choice(user_agents_list)}
-                    book_info = get_books_info(base_url, asin, headers=headers)
-                    # Check if critical fields are empty
-                    critical_fields = ['Authors', 'Illustrators', 'Description', 'Preface']
-                    is_incomplete = any(not book_info.get(field) for field in critical_fields) if book_info else True
-                    if book_info and not is_incomplete:
-                        books_info_list[idx] = book_info
-                        print_book_info(book_info)
-                        print(f"Successfully retrieved info for ASIN {asin} on retry {retries}.")
-                        completed_books += 1
-                        progress_bar['value'] = completed_books
-                        progress_bar.update()
-                    else:
-                        new_failed_indices.append(idx)
-                        retry_counts[asin] = retries + 1
-                        if is_incomplete:
-                            print(f"Retry {retries} failed for ASIN {asin}. Book info incomplete. Will retry again later.")
-                        else:
-                            print(f"Retry {retries} failed for ASIN {asin}. Will retry again later.")
-                if new_failed_indices == failed_indices:
-                    # No progress made, increase delay to prevent rate limiting
-                    delay *= 2
-                    print(f"No progress made. Increasing delay to {delay} seconds.")
+                    if self.closed and not self.heap and not self.outstanding:
+                        return
+                    timeout = self.poll_seconds
+                    if self.heap:
+                        timeout = min(timeout, self.heap[0][0] - now)
+                    if self.deadline is not None:
+                        timeout = min(timeout, self.deadline - now)
+                    self.condition.wait(timeout)
+            yield item
+
+def fetch_books(base_url, asins, indices, max_workers, transport, is_running, merged_books):
+    # Fetch product pages for the given indices with a bounded worker pool.
+    # Results are yielded as (idx, book_info) in completion order, so callers
+    # store them by index to keep the original series order.
+    def fetch(idx):
+        return transport.run(indexed_book_flow(base_url, asins, idx, is_running, merged_books))
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        yield from completed_fetches(lambda idx: executor.submit(fetch, idx), indices, max_workers * 2)
+    finally:
+        # Running fetches finish on their own
+        executor.shutdown(wait=False, cancel_futures=True)
+
+class SyncCrawlEngine(object):
+    # Blocking crawl engine: one call per page, product pages on a thread pool
+    def __init__(self, session, max_workers, title_index=None):
+        self.session = session
+        self.max_workers = max_workers
+        self.title_index = title_index
+        self.transport = SessionTransport(session, max_workers)
+
+    def find_series_link(self, base_url, search_input):
+        return find_known_series_link(self.title_index, search_input) or self.transport.run(series_link_flow(base_url, search_input))
+
+    def fetch_series_listing(self, series_url, base_url):
+        return self.transport.run(shared_series_listing_flow(series_url, base_url))
+
+    def fetch_series_info(self, series_url, base_url):
+        return self.fetch_series_listing(series_url, base_url).wait()
+
+    def fetch_book(self, base_url, asin, headers=None):
+        return self.transport.run(shared_book_info_flow(base_url, asin, headers))
+
+    def fetch_books(self, base_url, asins, indices, is_running, merged_books):
+        return fetch_books(base_url, asins, indices, self.max_workers, self.transport, is_running, merged_books)
+
+    def print_stats(self):
+        self.session.print_stats()
+        single_flight.print_stats()
+        book_store.print_stats()
+        page_parser.print_stats()
+
+    def close(self):
+        self.session.close()
+        page_parser.stop_workers()
+        if self.title_index:
+            self.title_index.close()
+
+class AsyncResponse(object):
+    # The few response fields the crawl reads, filled from an aiohttp response
+    def __init__(self, url, status_code, text):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+
+class AsyncTransport(CrawlTransport):
+    # Crawl flow steps as coroutines on the async engine's loop
+    def __init__(self, engine):
+        self.engine = engine
+
+    async def run(self, flow):
+        result = error = None
+        while True:
+            try:
+                step = flow.send(result) if error is None else flow.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                result, error = await getattr(self, step[0])(*step[1:]), None
+            except BaseException as e:
+                result, error = None, e
+
+    async def get(self, url, headers=None, url_class=None, use_cache=True, streamed=False):
+        section_ids = product_page_sections if streamed and self.engine.session.stream_product_pages else None
+        return await self.engine.get(url, headers, url_class, use_cache, section_ids)
+
+    async def parse(self, function, *args):
+        return await page_parser.parse_async(function, *args)
+
+    async def forget(self, url):
+        self.engine.session.forget_response(url)
+
+    async def pause(self, listing, seconds):
+        await asyncio.sleep(seconds)
+
+    async def coalesce(self, key, flow):
+        return await single_flight.do_async(key, lambda: self.run(flow))
+
+    async def start(self, flow):
+        task = asyncio.ensure_future(self.run(flow))
+        self.engine.series_tasks.add(task)
+        task.add_done_callback(self.engine.series_tasks.discard)
+
+    async def add_pages(self, listing, flows):
+        # Fetch every page at once and list each page's books as soon as the
+        # pages before it are in
+        tasks = [asyncio.ensure_future(self.run(flow)) for flow in flows]
+        try:
+            for task in tasks:
+                if listing.cancelled:
+                    break
+                listing.add(await task)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+class AsyncCrawlEngine(object):
+    # Runs one asyncio event loop in a background thread for the whole crawl.
+    # Every fetch is a coroutine gated by a semaphore, so the number of requests
+    # in flight is set by async_concurrency rather than by a thread count. The
+    # crawl flows are the sync engine's, run by an AsyncTransport.
+    def __init__(self, session, concurrency, title_index=None):
+        self.session = session
+        self.concurrency = concurrency
+        self.title_index = title_index
+        self.transport = AsyncTransport(self)
+        self.requests_sent = 0
+        # Series pagination tasks still running after their page 1 was returned
+        self.series_tasks = set()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.run(self.open())
+
+    async def open(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        if aiohttp:
+            connector = aiohttp.TCPConnector(limit=self.concurrency)
+            timeout = aiohttp.ClientTimeout(total=self.session.timeout)
+            # aiohttp negotiates the encodings it can decode itself
+            headers = {key: value for key, value in self.session.session.headers.items() if key.lower() != 'accept-encoding'}
+            self.http = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers)
+            self.executor = None
+        else:
+            print("aiohttp is not installed; the async engine will use the requests session in threads.")
+            self.http = None
+            self.executor = ThreadPoolExecutor(max_workers=min(self.concurrency, self.session.pool_size))
+
+    def submit(self, coro):
+        # Schedule a coroutine on the engine loop from any thread
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        return self.submit(coro).result()
+
+    async def get(self, url, headers=None, url_class=None, use_cache=True, section_ids=None):
+        # Concurrent requests for the same page share one response
+        kind = 'stream' if section_ids else 'get'
+        key = (kind, remove_language_parameter(url), url_class, use_cache)
+        result, shared = await single_flight.do_async(key, lambda: self.fetch(url, headers, url_class, use_cache, section_ids))
+        return result
+
+    async def fetch(self, url, headers=None, url_class=None, use_cache=True, section_ids=None):
+        # With section_ids the body is streamed and reading stops once every
+        # listed element has arrived, as in CrawlSession.get_streamed()
+        if self.http is None:
+            if section_ids:
+                fetch = functools.partial(self.session.fetch_streamed, url, headers=headers, url_class=url_class,
+                                          section_ids=section_ids, use_cache=use_cache)
+            else:
+                fetch = functools.partial(self.session.fetch, url, headers=headers, url_class=url_class, use_cache=use_cache)
+            async with self.semaphore:
+                return await self.loop.run_in_executor(self.executor, fetch)
+
+        cache_key = remove_language_parameter(url)
+        if use_cache:
+            cached, headers = self.session.cached_response(cache_key, url_class, headers)
+            if cached:
+                return cached
+
+        truncated = False
+        async with self.semaphore:
+            rate_controller = self.session.rate_controller
+            if rate_controller:
+                delay = rate_controller.reserve(url)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self.requests_sent += 1
+            started = time.monotonic()
+            try:
+                response = await self.http.get(url, headers=headers)
+            except asyncio.TimeoutError:
+                metrics.count('http_errors', url_class=url_class or 'default', error='timeout')
+                if rate_controller:
+                    rate_controller.record_error(url, "timeout")
+                raise
+            except aiohttp.ClientConnectionError:
+                metrics.count('http_errors', url_class=url_class or 'default', error='connection')
+                if rate_controller:
+                    rate_controller.record_error(url, "connection error")
+                raise
+            headers_seconds = time.monotonic() - started
+            metrics.count('http_responses', url_class=url_class or 'default', status=response.status)
+            metrics.observe('http_request', headers_seconds, url_class=url_class or 'default', phase='headers')
+            if rate_controller:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                rate_controller.record(url, response.status, headers_seconds, retry_after)
+            async with response:
+                # get_encoding() would need the body first to guess a missing charset
+                encoding = response.charset or 'utf-8'
+                status_code = response.status
+                response_headers = response.headers
+                if section_ids and status_code == 200:
+                    reader = PageStreamReader(section_ids, encoding)
+                    async for chunk in response.content.iter_chunked(self.session.stream_chunk_size):
+                        if reader.feed(chunk):
+                            truncated = True
+                            break
+                    content = reader.content
+                    # aiohttp hands out decoded bytes, so savings are only known for uncompressed bodies
+                    total_bytes = response.content_length if not response_headers.get('Content-Encoding') else None
+                    self.session.record_stream(reader.bytes_read, total_bytes, truncated)
                 else:
-                    # Reset delay if progress is made
-                    delay = 1
-                failed_indices = new_failed_indices
-
-            # Log any ASINs that could not be retrieved after retries
-            for idx in failed_indices:
-                asin = series_info['Books ASINs'][idx]
-                print(f"Failed to retrieve complete info for ASIN {asin} after {max_retries} retries.")
-
-            # Export all collected data to an HTML file
-            export_to_html(series_info, books_info_list, base_url, single_book=False)
-            print("Exported data to HTML.")
-            submit_button.config(text="Submit")
+                    content = await response.read()
+                metrics.observe('http_request', time.monotonic() - started - headers_seconds, url_class=url_class or 'default', phase='transfer')
+                metrics.count('http_bytes', len(content), url_class=url_class or 'default')
 
-            # Notify user
-            messagebox.showinfo("Export Complete", "Exported data to the /output folder.")
+        cached = self.session.remember_response(cache_key, status_code, content, encoding, response_headers)
+        if cached:
+            return cached
+        if section_ids and status_code == 200:
+            return StreamedResponse(url, status_code, content, encoding, response_headers, truncated)
+        return AsyncResponse(url, status_code, content.decode(encoding, errors='replace'))
+
+    def find_series_link(self, base_url, search_input):
+        return find_known_series_link(self.title_index, search_input) or self.run(self.transport.run(series_link_flow(base_url, search_input)))
+
+    def fetch_series_listing(self, series_url, base_url):
+        return self.run(self.transport.run(shared_series_listing_flow(series_url, base_url)))
+
+    def fetch_series_info(self, series_url, base_url):
+        return self.fetch_series_listing(series_url, base_url).wait()
+
+    def fetch_book(self, base_url, asin, headers=None):
+        return self.run(self.transport.run(shared_book_info_flow(base_url, asin, headers)))
+
+    def fetch_books(self, base_url, asins, indices, is_running, merged_books):
+        # Same contract as fetch_books(): (idx, book_info) in completion order
+        return completed_fetches(lambda idx: self.submit(self.transport.run(indexed_book_flow(base_url, asins, idx, is_running, merged_books))),
+                                 indices, self.concurrency * 2)
+
+    def print_stats(self):
+        if self.http is None:
+            self.session.print_stats()
         else:
-            # If no books found in series, treat it as a single book
-            print("No books found in series. Treating as single book.")
-            asin = series_link.split('/dp/')[1].split('/')[0]
-            headers = {"User-Agent": random.choice(user_agents_list)}
-            book_info = get_books_info(base_url, asin, headers=headers)
+            print(f"HTTP (async): {self.requests_sent} requests sent.")
+            self.session.print_stream_stats()
+            if self.session.cache is not None:
+                self.session.cache.print_stats()
+        single_flight.print_stats()
+        book_store.print_stats()
+        page_parser.print_stats()
+
+    async def close_http(self):
+        for task in list(self.series_tasks):
+            task.cancel()
+        if self.http is not None:
+            await self.http.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        self.run(self.close_http())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.session.close()
+        page_parser.stop_workers()
+        if self.title_index:
+            self.title_index.close()
+
+def create_crawl_engine(config, engine_name=None):
+    page_parser.configure(config.get("parser", "auto"))
+    page_parser.start_workers(int(config.get("parse_workers", 0)))
+    retry_policy.configure(config)
+    metrics.reset()
+    single_flight.reset()
+    book_store.reset(int(config.get("book_store_size", 50000)))
+    session = create_session(config)
+    title_index = create_title_index(config)
+    engine_name = engine_name or config.get("engine", "sync")
+    if engine_name == 'async':
+        return AsyncCrawlEngine(session, max(1, int(config.get("async_concurrency", 50))), title_index)
+    return SyncCrawlEngine(session, max(1, int(config.get("max_workers", 1))), title_index)
+
+def series_manifest_key(series_url):
+    # A series is identified by its page path; tracking parameters change between searches
+    parsed_url = urllib.parse.urlparse(remove_language_parameter(series_url))
+    return urllib.parse.urlunparse(parsed_url._replace(query='', fragment=''))
+
+def series_manifest_path(config, series_url):
+    digest = hashlib.sha1(series_manifest_key(series_url).encode('utf-8')).hexdigest()
+    return os.path.join(config.get("manifest_dir", "manifests"), f"{digest}.json")
+
+def load_series_manifest(config, series_url):
+    manifest_path = series_manifest_path(config, series_url)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        manifest['series_info'] = Series.from_dict(manifest.get('series_info') or {})
+        for entry in manifest['books'].values():
+            if entry.get('record'):
+                entry['record'] = Book.from_dict(entry['record'])
+        return manifest
+    return {
+        'series_url': series_manifest_key(series_url),
+        'series_info': Series(),
+        'asins': [],
+        'books': {},
+        'updated_at': 0
+    }
+
+def save_series_manifest(config, manifest):
+    manifest_path = series_manifest_path(config, manifest['series_url'])
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    # Write to a temporary file first so a crash never leaves a half-written manifest
+    temp_path = f"{manifest_path}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, default=record_to_json)
+    os.replace(temp_path, manifest_path)
+
+class KeyedLocks(object):
+    # One lock per key, dropped again once nobody holds or waits for it
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key -> [lock, holders and waiters]
+        self.locks = {}
+
+    @contextlib.contextmanager
+    def hold(self, key):
+        with self.lock:
+            entry = self.locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.locks[key]
+
+# Crawls of the same series, e.g. two batch queries that resolve to it, take
+# turns so that each one reads the manifest the previous one saved
+series_locks = KeyedLocks()
+
+def book_needs_refresh(entry, stale_seconds, now):
+    # Books that are new, were incomplete last time, or are out of date
+    return not entry or not entry.get('complete') or now - entry.get('fetched_at', 0) > stale_seconds
+
+def update_series_manifest(manifest, series_info, refreshed_books, failed_books):
+    now = time.time()
+    manifest['series_info'] = series_info
+    manifest['asins'] = list(series_info.get('Books ASINs', []))
+    for asin, book_info in refreshed_books.items():
+        manifest['books'][asin] = {'record': book_info, 'fetched_at': now, 'complete': True}
+    for asin, partial_book_info in failed_books.items():
+        # Keep an older complete record for the export, or else the partial one,
+        # and fetch the book again next time
+        entry = manifest['books'].setdefault(asin, {'record': None, 'fetched_at': 0})
+        if not entry.get('record') and partial_book_info:
+            entry['record'] = partial_book_info
+            entry['fetched_at'] = now
+        entry['complete'] = False
+    manifest['updated_at'] = now
+
+def describe_missing_fields(merged):
+    if merged.book_info is None:
+        return "No product page could be read"
+    return f"Book info incomplete, missing {', '.join(merged.missing_fields())}"
+
+def crawl_series(engine, config, series_link, is_running=lambda: True, on_progress=None, log_books=True,
+                 on_series=None, on_book=None):
+    # Fetch the series page(s) and every book of the series. Returns
+    # (series_info, books_info_list), with books_info_list in series order, or
+    # (series_info, None) when the page lists no books. on_series(series_info)
+    # runs before the books are fetched and on_book(idx, book_info) as soon as
+    # a book's record is final. Books are fetched as soon as the series page
+    # listing them is in, while the later pages are still being fetched.
+    if not config.get("incremental_refresh", True):
+        return crawl_series_books(engine, config, series_link, is_running, on_progress, log_books, on_series, on_book)
+    with series_locks.hold(series_manifest_key(series_link)):
+        return crawl_series_books(engine, config, series_link, is_running, on_progress, log_books, on_series, on_book)
+
+def crawl_series_books(engine, config, series_link, is_running, on_progress, log_books, on_series, on_book):
+    base_url = config.get("baseurl", "")
+    started = time.monotonic()
+    listing = engine.fetch_series_listing(series_link, base_url)
+    series_info = listing.series_info
+    if not series_info.get('Books ASINs') and not listing.wait().get('Books ASINs'):
+        return series_info, None
+    if on_series:
+        on_series(series_info)
+
+    def book_done(idx, book_info):
+        if on_book:
+            on_book(idx, book_info)
+
+    if log_books:
+        print_series_info(series_info)
+    # Grows until every series page is in
+    asins = series_info.get('Books ASINs', [])
+    # Final records by index; the list in series order is built at the end
+    books_info = {}
+    given_up_indices = []
+    # Attempts so far by ASIN, for books that were fetched and came back incomplete
+    retry_counts = {}
+
+    # Failed books are tried again as soon as their own backoff has passed,
+    # in between the first attempts of the others. Nothing new is started
+    # once the crawl deadline has passed.
+    scheduler = RetryScheduler(retry_policy, retry_policy.deadline(started), is_running)
+
+    # Books that are either complete or have run out of retries
+    completed_books = 0
+    # Books fetched successfully during this run, by ASIN
+    refreshed_books = {}
+
+    def report_progress():
+        if on_progress:
+            total_books = len(asins) if listing.done else max(listing.total_books, len(asins))
+            on_progress(completed_books, total_books)
+
+    # Only fetch books the manifest does not already hold up to date
+    manifest = None
+    if config.get("incremental_refresh", True):
+        manifest = load_series_manifest(config, series_link)
+        stale_seconds = float(config.get("manifest_stale_days", 30)) * 86400
+
+    def earlier_record(idx):
+        entry = manifest['books'].get(asins[idx]) if manifest else None
+        return entry.get('record') if entry else None
+
+    # Indices sent to be fetched, and books the manifest holds up to date
+    fetch_indices = []
+    up_to_date = queue.SimpleQueue()
+    up_to_date_books = 0
+    # Fields are merged across attempts; a partial record from an earlier run is a starting point
+    merged_books = {}
+
+    def schedule_books():
+        # Runs on its own thread while the series pages come in
+        now = time.time()
+        error = None
+        try:
+            for idx, asin in enumerate(listing):
+                entry = manifest['books'].get(asin) if manifest is not None else None
+                if manifest is not None and not book_needs_refresh(entry, stale_seconds, now):
+                    up_to_date.put(idx)
+                    continue
+                partial_book_info = entry.get('record') if entry and not entry.get('complete') else None
+                merged_books[asin] = MergedBookInfo(asin, partial_book_info)
+                fetch_indices.append(idx)
+                scheduler.add(idx)
+        except Exception as e:
+            error = e
+        finally:
+            scheduler.close(error)
+
+    def take_up_to_date():
+        nonlocal completed_books, up_to_date_books
+        while True:
+            try:
+                idx = up_to_date.get_nowait()
+            except queue.Empty:
+                return
+            books_info[idx] = earlier_record(idx)
+            book_done(idx, books_info[idx])
+            completed_books += 1
+            up_to_date_books += 1
+            report_progress()
+
+    last_checkpoint = time.monotonic()
+
+    def save_manifest(attempted_only):
+        nonlocal last_checkpoint
+        # Books not attempted yet keep their old manifest entry
+        failed_books = {}
+        for idx in fetch_indices:
+            asin = asins[idx]
+            if asin not in refreshed_books and (asin in retry_counts or not attempted_only):
+                failed_books[asin] = merged_books[asin].book_info
+        update_series_manifest(manifest, series_info, refreshed_books, failed_books)
+        save_series_manifest(config, manifest)
+        last_checkpoint = time.monotonic()
+
+    def checkpoint():
+        # Save progress every few seconds so that a stopped or killed crawl
+        # picks up from here next time
+        if manifest is not None and time.monotonic() - last_checkpoint >= 5:
+            save_manifest(attempted_only=True)
+
+    report_progress()
+    threading.Thread(target=schedule_books, daemon=True).start()
+
+    # First attempts and retries, in the order they become due
+    try:
+        for idx, book_info in engine.fetch_books(base_url, asins, scheduler, is_running, merged_books):
+            take_up_to_date()
+            if not is_running():
+                break
+            asin = asins[idx]
+            attempts = retry_counts.get(asin, 0) + 1
+            if attempts > 1:
+                metrics.count('book_retries')
+            merged = merged_books[asin]
+            if merged.is_complete():
+                books_info[idx] = merged.book_info
+                refreshed_books[asin] = merged.book_info
+                book_done(idx, merged.book_info)
+                if log_books:
+                    print_book_info(merged.book_info)
+                if attempts > 1:
+                    print(f"Successfully retrieved info for ASIN {asin} on retry {attempts - 1}.")
+                completed_books += 1
+                report_progress()
+                scheduler.done(idx)
+            else:
+                retry_counts[asin] = attempts
+                delay = scheduler.retry(idx, attempts)
+                if delay is not None:
+                    print(f"{describe_missing_fields(merged)} for ASIN {asin} (attempt {attempts}). Retrying in {delay:.1f}s.")
+                else:
+                    reason = "Max retries reached" if attempts >= retry_policy.max_attempts else "Crawl deadline reached"
+                    print(f"{describe_missing_fields(merged)} for ASIN {asin}. {reason}. Skipping.")
+                    given_up_indices.append(idx)
+                    completed_books += 1
+                    report_progress()
+            checkpoint()
+    finally:
+        scheduler.cancel()
+    if not is_running():
+        print("Process stopped by user.")
+        listing.cancel()
+    elif scheduler.expired:
+        not_fetched = sum(1 for idx in scheduler.pending() if asins[idx] not in retry_counts)
+        print(f"Crawl deadline of {retry_policy.deadline_seconds:g}s reached. {not_fetched} books were not fetched.")
+        listing.cancel()
+    take_up_to_date()
+    if up_to_date_books:
+        print(f"{up_to_date_books} books were up to date in the manifest. Fetched {len(fetch_indices)} books.")
+
+    # Log any ASINs that could not be retrieved; books still waiting for a
+    # retry when the crawl was stopped count as well
+    waiting_indices = [idx for idx in scheduler.pending() if asins[idx] in retry_counts]
+    for idx in sorted(given_up_indices + waiting_indices):
+        asin = asins[idx]
+        print(f"Failed to retrieve complete info for ASIN {asin} after {retry_counts.get(asin, 0)} attempts.")
+        # Export whatever fields were found rather than nothing
+        books_info[idx] = earlier_record(idx) or merged_books[asin].book_info
+        book_done(idx, books_info[idx])
+
+    if manifest is not None:
+        save_manifest(attempted_only=False)
+
+    # Books never attempted (the crawl was stopped) keep their earlier record
+    for idx in range(len(asins)):
+        if books_info.get(idx) is None and earlier_record(idx):
+            books_info[idx] = earlier_record(idx)
+            book_done(idx, books_info[idx])
+    books_info_list = [books_info.get(idx) for idx in range(len(asins))]
+    return series_info, books_info_list
+
+def crawl_single_book(engine, config, book_link):
+    # A link without a series page is crawled as one book
+    if '/dp/' not in book_link:
+        print(f"Cannot find an ASIN in {book_link}.")
+        return None
+    asin = book_link.split('/dp/')[1].split('/')[0].split('?')[0]
+    headers = {"User-Agent": random.choice(user_agents_list)}
+    book_info = engine.fetch_book(config.get("baseurl", ""), asin, headers=headers)
+    if not book_info:
+        print(f"Failed to retrieve book info for ASIN {asin}.")
+    return book_info
+
+def run_application(search_input, log_text_widget, progress_bar, submit_button, redirect_text, engine_name=None):
+    from tkinter import messagebox
+
+    # Set sys.stdout to redirect_text inside the thread
+    sys.stdout = redirect_text
+
+    # Whatever happens, the engine is closed and the button reads Submit again
+    engine = None
+    try:
+        config = load_config()
+        base_url = config.get("baseurl", "")
+        engine = create_crawl_engine(config, engine_name)
+        is_running = lambda: submit_button.running
+
+        def show_progress(completed_books, total_books):
+            def update():
+                progress_bar['maximum'] = total_books
+                progress_bar['value'] = completed_books
+            redirect_text.call(update)
+
+        def show_done(message):
+            redirect_text.call(lambda: messagebox.showinfo("Export Complete", message))
+
+        # The export is written while the books come in and put in series order at the end
+        export = None
+
+        def start_export(series_info):
+            nonlocal export
+            export = StreamingExport(series_info, base_url)
+            print(f"Writing books to {export.partial_html_path} and {export.partial_jsonl_path} as they finish.")
+
+        def export_book(idx, book_info):
+            export.add(idx, book_info)
+
+        series_link = engine.find_series_link(base_url, search_input)
+        if series_link:
+            try:
+                series_info, books_info_list = crawl_series(engine, config, series_link, is_running, show_progress,
+                                                            on_series=start_export, on_book=export_book)
+            except BaseException:
+                if export:
+                    export.close()
+                raise
+            if books_info_list is not None:
+                # Export all collected data to an HTML file
+                export.finish(download_cover_images(config, series_info, books_info_list))
+                print("Exported data to HTML.")
+                add_to_catalog(config, series_link, series_info, books_info_list)
+
+                # Notify user
+                show_done("Exported data to the /output folder.")
+            else:
+                # If no books found in series, treat it as a single book
+                print("No books found in series. Treating as single book.")
+                book_info = crawl_single_book(engine, config, series_link)
+                if book_info:
+                    print_book_info(book_info)
+                    export_to_html(Series(), [book_info], base_url, single_book=True,
+                                   images=download_cover_images(config, Series(), [book_info]))
+                    print("Exported single book data to HTML.")
+                    add_to_catalog(config, None, Series(), [book_info])
+                    show_done("Exported data to the /output folder.")
+    except Exception as e:
+        print(f"The crawl stopped with an error: {e!r}")
+        raise
+    finally:
+        if engine is not None:
+            engine.print_stats()
+            engine.close()
+            write_run_metrics(config)
+        redirect_text.call(lambda: submit_button.config(text="Submit"))
+
+def read_batch_queries(path):
+    # Each line is a JSON string or an object with a "query" (or "url"/"name") field
+    queries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping line {line_number} of {path}: {e}")
+                continue
+            if isinstance(item, dict):
+                item = item.get('query') or item.get('url') or item.get('name')
+            if isinstance(item, str) and item.strip():
+                queries.append(item.strip())
+            else:
+                print(f"Skipping line {line_number} of {path}: no query found.")
+    return queries
+
+def book_result_line(book_info, query, series_url, series_title, idx):
+    return dict(book_info.to_dict(), query=query, series_url=series_url, series_title=series_title, index=idx)
+
+def crawl_query_records(engine, config, query, catalog=None, is_running=lambda: True, on_progress=None):
+    # Resolve one query to (series_url, series_info, books_info_list, error).
+    # A book without a series comes back as a one-book list with series_url None.
+    base_url = config.get("baseurl", "")
+    series_link = engine.find_series_link(base_url, query)
+    if not series_link:
+        # A book link whose page names no series is still worth one line
+        if '/dp/' in query:
+            book_info = crawl_single_book(engine, config, query)
             if book_info:
-                print_book_info(book_info)
-                export_to_html({}, [book_info], base_url, single_book=True)
-                print("Exported single book data to HTML.")
-                messagebox.showinfo("Export Complete", "Exported data to the /output folder.")
+                if catalog:
+                    catalog.upsert_series(None, Series(), [book_info])
+                return None, Series(), [book_info], None
+        return None, None, None, 'No matching series found.'
+
+    series_info, books_info_list = crawl_series(engine, config, series_link, is_running, on_progress, log_books=False)
+    if books_info_list is None:
+        book_info = crawl_single_book(engine, config, series_link)
+        if not book_info:
+            return series_link, None, None, 'Failed to retrieve book info.'
+        if catalog:
+            catalog.upsert_series(None, Series(), [book_info])
+        return None, Series(), [book_info], None
+
+    if catalog:
+        catalog.upsert_series(series_link, series_info, books_info_list)
+    return series_link, series_info, books_info_list, None
+
+def crawl_query(engine, config, query, catalog=None):
+    # Resolve one batch query and return the JSONL result lines for it
+    return query_result_lines(query, *crawl_query_records(engine, config, query, catalog))
+
+def query_result_lines(query, series_link, series_info, books_info_list, error):
+    if error:
+        line = {'query': query}
+        if series_link:
+            line['series_url'] = series_link
+        line['error'] = error
+        return [line]
+    if series_link is None:
+        return [book_result_line(books_info_list[0], query, None, None, 0)]
+
+    results = []
+    for idx, book_info in enumerate(books_info_list):
+        if book_info:
+            results.append(book_result_line(book_info, query, series_link, series_info.get('Series Title'), idx))
+        else:
+            asin = series_info['Books ASINs'][idx]
+            results.append({'query': query, 'series_url': series_link, 'ASIN': asin, 'index': idx, 'error': 'Failed to retrieve book info.'})
+    return results
+
+def run_batch(input_path, output_path, engine_name=None, concurrency=None):
+    # Headless mode: crawl every query of a JSONL file, several at a time,
+    # through one engine so they all share the session and rate controller
+    config = load_config()
+    queries = read_batch_queries(input_path)
+    concurrency = max(1, int(concurrency or config.get("batch_concurrency", 4)))
+    engine = create_crawl_engine(config, engine_name)
+    catalog = create_catalog(config)
+    started = time.monotonic()
+    books_written = 0
+    failed_queries = 0
+
+    print(f"Crawling {len(queries)} queries, {concurrency} at a time.")
+    with open(output_path, 'w', encoding='utf-8') as output_file, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(crawl_query, engine, config, query, catalog): query for query in queries}
+        for future in as_completed(futures):
+            query = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                results = [{'query': query, 'error': repr(e)}]
+            for result in results:
+                output_file.write(json.dumps(result, ensure_ascii=False) + '\n')
+                if 'error' not in result:
+                    books_written += 1
+            if any('error' in result and 'ASIN' not in result for result in results):
+                failed_queries += 1
+            output_file.flush()
+            print(f"Finished query: {query} ({len(results)} lines)")
+
+    elapsed = time.monotonic() - started
+    engine.print_stats()
+    engine.close()
+    if catalog:
+        catalog.close()
+    write_run_metrics(config)
+    print(f"Batch done: {len(queries)} queries ({failed_queries} failed), {books_written} books in {elapsed:.1f}s "
+          f"({books_written / elapsed if elapsed else 0:.2f} books/s). Results written to {output_path}")
+
+class CrawlQueue(object):
+    # Durable job queue kept in one SQLite file, which any number of worker
+    # processes can drain together. A series job turns a query into one book
+    # task per ASIN. Claimed jobs are leased to their worker: if the worker
+    # dies, the job goes back to the queue once the lease runs out.
+    tables = ('series_jobs', 'book_tasks')
+
+    def __init__(self, path, lease_seconds=300):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.lease_seconds = lease_seconds
+        self.lock = threading.Lock()
+        # Transactions are opened by hand so that claiming is one atomic step
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        # The rollback journal, not WAL: WAL needs shared memory and does not
+        # work for workers on different machines sharing the file. Setting it
+        # also converts a queue file created in WAL mode.
+        self.db.execute("PRAGMA journal_mode=DELETE")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS series_jobs (
+                query TEXT PRIMARY KEY,
+                series_url TEXT,
+                series_info TEXT,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_eligible REAL NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires REAL,
+                error TEXT,
+                updated_at REAL
+            )""")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS book_tasks (
+                query TEXT NOT NULL,
+                asin TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_eligible REAL NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires REAL,
+                record TEXT,
+                error TEXT,
+                updated_at REAL,
+                PRIMARY KEY (query, asin)
+            )""")
+        for table in self.tables:
+            self.db.execute(f"CREATE INDEX IF NOT EXISTS {table}_claim ON {table} (state, next_eligible)")
+
+    def transaction(self, work):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers never claim the same job
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                result = work()
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+            return result
+
+    def enqueue(self, queries):
+        now = time.time()
+
+        def work():
+            added = 0
+            for query in queries:
+                cursor = self.db.execute("INSERT OR IGNORE INTO series_jobs (query, updated_at) VALUES (?, ?)", (query, now))
+                added += cursor.rowcount
+            return added
+        return self.transaction(work)
+
+    def claim(self, table, owner, limit, max_attempts):
+        # Lease up to `limit` jobs that are due, including ones whose worker
+        # let the lease run out. Jobs that used up their attempts that way fail.
+        key_columns = 'query' if table == 'series_jobs' else 'query, asin'
+        data_columns = 'series_url' if table == 'series_jobs' else 'idx, record'
+
+        def work():
+            now = time.time()
+            self.db.execute(
+                f"UPDATE {table} SET state = 'failed', error = 'Lease expired too often.', lease_owner = NULL, updated_at = ? "
+                "WHERE state = 'in_flight' AND lease_expires <= ? AND attempts >= ?", (now, now, max_attempts))
+            rows = self.db.execute(
+                f"SELECT rowid, {key_columns}, {data_columns}, attempts FROM {table} "
+                "WHERE (state = 'pending' AND next_eligible <= ?) OR (state = 'in_flight' AND lease_expires <= ?) "
+                "ORDER BY next_eligible, rowid LIMIT ?", (now, now, limit)).fetchall()
+            for row in rows:
+                self.db.execute(
+                    f"UPDATE {table} SET state = 'in_flight', attempts = attempts + 1, lease_owner = ?, lease_expires = ?, updated_at = ? "
+                    "WHERE rowid = ?", (owner, now + self.lease_seconds, now, row[0]))
+            return [row[1:-1] + (row[-1] + 1,) for row in rows]
+        return self.transaction(work)
+
+    def finish_series(self, owner, query, series_url, series_info, asins):
+        # Mark the series job done and queue one task per book
+        def work():
+            now = time.time()
+            cursor = self.db.execute(
+                "UPDATE series_jobs SET state = 'done', series_url = ?, series_info = ?, lease_owner = NULL, error = NULL, updated_at = ? "
+                "WHERE query = ? AND lease_owner = ?",
+                (series_url, json.dumps(series_info.to_dict(), ensure_ascii=False), now, query, owner))
+            if cursor.rowcount:
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO book_tasks (query, asin, idx, updated_at) VALUES (?, ?, ?, ?)",
+                    [(query, asin, idx, now) for idx, asin in enumerate(asins)])
+            return cursor.rowcount
+        return self.transaction(work)
+
+    def finish_book(self, owner, query, asin, record):
+        def work():
+            return self.db.execute(
+                "UPDATE book_tasks SET state = 'done', record = ?, lease_owner = NULL, error = NULL, updated_at = ? "
+                "WHERE query = ? AND asin = ? AND lease_owner = ?",
+                (json.dumps(record.to_dict(), ensure_ascii=False), time.time(), query, asin, owner)).rowcount
+        return self.transaction(work)
+
+    def retry(self, table, owner, key, attempts, max_attempts, delay, error, record=None):
+        # Put a job back with a delay, or fail it once it used up its attempts.
+        # The lease owner check stops a worker whose lease ran out from
+        # overwriting the job after someone else took it over.
+        key_filter = 'query = ?' if table == 'series_jobs' else 'query = ? AND asin = ?'
+        state = 'failed' if attempts >= max_attempts else 'pending'
+        metrics.count('queue_retries', table=table, result=state)
+        record_update = ', record = COALESCE(?, record)' if table == 'book_tasks' else ''
+        record_value = () if table == 'series_jobs' else (json.dumps(record.to_dict(), ensure_ascii=False) if record else None,)
+
+        def work():
+            now = time.time()
+            return self.db.execute(
+                f"UPDATE {table} SET state = ?, next_eligible = ?, error = ?, lease_owner = NULL{record_update}, updated_at = ? "
+                f"WHERE {key_filter} AND lease_owner = ?",
+                (state, now + delay, error) + record_value + (now,) + tuple(key) + (owner,)).rowcount
+        return self.transaction(work)
+
+    def release(self, owner):
+        # Hand back everything this worker holds, e.g. when it is stopped with Ctrl+C
+        def work():
+            released = 0
+            for table in self.tables:
+                released += self.db.execute(
+                    f"UPDATE {table} SET state = 'pending', attempts = MAX(attempts - 1, 0), lease_owner = NULL, updated_at = ? "
+                    "WHERE state = 'in_flight' AND lease_owner = ?", (time.time(), owner)).rowcount
+            return released
+        return self.transaction(work)
+
+    def next_due(self):
+        # Seconds until the next job can be claimed, or None once everything is done or failed
+        with self.lock:
+            times = []
+            for table in self.tables:
+                row = self.db.execute(
+                    f"SELECT MIN(CASE state WHEN 'pending' THEN next_eligible ELSE lease_expires END) FROM {table} "
+                    "WHERE state IN ('pending', 'in_flight')").fetchone()
+                if row[0] is not None:
+                    times.append(row[0])
+        return max(0, min(times) - time.time()) if times else None
+
+    def counts(self):
+        with self.lock:
+            return {
+                table: dict(self.db.execute(f"SELECT state, COUNT(*) FROM {table} GROUP BY state").fetchall())
+                for table in self.tables
+            }
+
+    def print_status(self):
+        counts = self.counts()
+        for table, label in (('series_jobs', 'Series'), ('book_tasks', 'Books')):
+            states = counts[table]
+            print(f"{label}: {states.get('done', 0)} done, {states.get('pending', 0)} pending, "
+                  f"{states.get('in_flight', 0)} in flight, {states.get('failed', 0)} failed.")
+
+    def series_records(self):
+        # (query, series_url, series_info, state, error, book rows) per series job;
+        # book rows are (asin, idx, state, record, error) in series order
+        with self.lock:
+            series_rows = self.db.execute(
+                "SELECT query, series_url, series_info, state, error FROM series_jobs ORDER BY rowid").fetchall()
+            book_rows = self.db.execute(
+                "SELECT query, asin, idx, state, record, error FROM book_tasks ORDER BY query, idx").fetchall()
+        books_by_query = {}
+        for query, asin, idx, state, record, error in book_rows:
+            books_by_query.setdefault(query, []).append((asin, idx, state, Book.from_dict(json.loads(record)) if record else None, error))
+        for query, series_url, series_info, state, error in series_rows:
+            yield query, series_url, Series.from_dict(json.loads(series_info) if series_info else {}), state, error, books_by_query.get(query, [])
+
+    def results(self):
+        # Batch-style result lines for every finished query, books in series order
+        for query, series_url, series_info, state, error, books in self.series_records():
+            if state == 'failed':
+                yield {'query': query, 'error': error}
+                continue
+            for asin, idx, book_state, record, book_error in books:
+                if record:
+                    yield book_result_line(record, query, series_url, series_info.title or None, idx)
+                elif book_state == 'failed':
+                    yield {'query': query, 'series_url': series_url, 'ASIN': asin, 'index': idx, 'error': book_error}
+
+    def close(self):
+        self.db.close()
+
+def queue_owner_name():
+    # Identifies this worker in the leases it holds
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def process_series_job(engine, config, crawl_queue, owner, query, attempts, max_attempts):
+    base_url = config.get("baseurl", "")
+    retry_seconds = float(config.get("queue_retry_seconds", 60))
+    series_link = engine.find_series_link(base_url, query)
+    if not series_link:
+        if '/dp/' in query:
+            # A book link whose page names no series becomes a single book task
+            asin = query.split('/dp/')[1].split('/')[0].split('?')[0]
+            crawl_queue.finish_series(owner, query, None, Series(), [asin])
+            return
+        print(f"No matching series found for {query} (attempt {attempts}).")
+        crawl_queue.retry('series_jobs', owner, (query,), attempts, max_attempts, retry_seconds * attempts, 'No matching series found.')
+        return
+
+    series_info = engine.fetch_series_info(series_link, base_url)
+    asins = series_info.get('Books ASINs', [])
+    if not asins and '/dp/' in series_link:
+        asins = [series_link.split('/dp/')[1].split('/')[0].split('?')[0]]
+        series_info, series_link = Series(), None
+    if not asins:
+        print(f"No books found for {query} (attempt {attempts}).")
+        crawl_queue.retry('series_jobs', owner, (query,), attempts, max_attempts, retry_seconds * attempts, 'No books found.')
+        return
+    crawl_queue.finish_series(owner, query, series_link, series_info, asins)
+    print(f"Queued {len(asins)} books for {query}.")
+
+def process_book_tasks(engine, config, crawl_queue, owner, tasks, max_attempts, is_running):
+    base_url = config.get("baseurl", "")
+    retry_seconds = float(config.get("queue_retry_seconds", 60))
+    # Several queries may share a book; it is fetched once for all of them
+    tasks_by_asin = {}
+    merged_books = {}
+    for query, asin, idx, record, attempts in tasks:
+        tasks_by_asin.setdefault(asin, []).append((query, attempts))
+        if asin not in merged_books:
+            merged_books[asin] = MergedBookInfo(asin, Book.from_dict(json.loads(record)) if record else None)
+    asins = list(tasks_by_asin)
+
+    for idx, book_info in engine.fetch_books(base_url, asins, range(len(asins)), is_running, merged_books):
+        asin = asins[idx]
+        merged = merged_books[asin]
+        for query, attempts in tasks_by_asin.pop(asin):
+            if merged.is_complete():
+                crawl_queue.finish_book(owner, query, asin, merged.book_info)
             else:
-                print(f"Failed to retrieve book info for ASIN {asin}.")
-    
-    submit_button.config(text="Submit")
+                print(f"{describe_missing_fields(merged)} for ASIN {asin} (attempt {attempts}).")
+                crawl_queue.retry('book_tasks', owner, (query, asin), attempts, max_attempts,
+                            retry_seconds * attempts, describe_missing_fields(merged), merged.book_info)
+        if not is_running():
+            break
+
+def run_queue_worker(queue_path, engine_name=None, input_path=None, output_path=None):
+    # Drain the job queue, optionally adding the queries of a JSONL file first.
+    # Start the same command on more processes or machines sharing the file to
+    # crawl faster; a stopped worker picks up where the queue left off.
+    config = load_config()
+    crawl_queue = CrawlQueue(queue_path, float(config.get("queue_lease_seconds", 300)))
+    if input_path:
+        queries = read_batch_queries(input_path)
+        print(f"Added {crawl_queue.enqueue(queries)} of {len(queries)} queries to the queue.")
+
+    engine = create_crawl_engine(config, engine_name)
+    owner = queue_owner_name()
+    max_attempts = max(1, int(config.get("queue_max_attempts", 5)))
+    retry_seconds = float(config.get("queue_retry_seconds", 60))
+    batch_size = max(1, int(config.get("max_workers", 4))) * 4
+    started = time.monotonic()
+    books_done = crawl_queue.counts()['book_tasks'].get('done', 0)
+    stopping = threading.Event()
+    is_running = lambda: not stopping.is_set()
+
+    try:
+        while True:
+            series_jobs = crawl_queue.claim('series_jobs', owner, 1, max_attempts)
+            for query, series_url, attempts in series_jobs:
+                try:
+                    process_series_job(engine, config, crawl_queue, owner, query, attempts, max_attempts)
+                except Exception as e:
+                    # A network error costs this job an attempt, not the worker its run
+                    print(f"Failed to process {query} (attempt {attempts}): {e!r}")
+                    crawl_queue.retry('series_jobs', owner, (query,), attempts, max_attempts, retry_seconds * attempts, repr(e))
+            book_tasks = crawl_queue.claim('book_tasks', owner, batch_size, max_attempts)
+            if book_tasks:
+                process_book_tasks(engine, config, crawl_queue, owner, book_tasks, max_attempts, is_running)
+                crawl_queue.print_status()
+            if series_jobs or book_tasks:
+                continue
+            wait_seconds = crawl_queue.next_due()
+            if wait_seconds is None:
+                break
+            # Other workers hold the remaining jobs, or they are waiting out a retry delay
+            time.sleep(min(max(wait_seconds, 0.1), 5))
+    except KeyboardInterrupt:
+        stopping.set()
+        print(f"Stopped. Handed back {crawl_queue.release(owner)} jobs to the queue.")
+    finally:
+        engine.print_stats()
+        engine.close()
+        write_run_metrics(config)
+
+    crawl_queue.print_status()
+    books_done = crawl_queue.counts()['book_tasks'].get('done', 0) - books_done
+    elapsed = time.monotonic() - started
+    print(f"{books_done} books were finished by all workers while this one ran for {elapsed:.1f}s.")
+    if output_path and not stopping.is_set():
+        with open(output_path, 'w', encoding='utf-8') as output_file:
+            for result in crawl_queue.results():
+                output_file.write(json.dumps(result, ensure_ascii=False) + '\n')
+        print(f"Results written to {output_path}")
+    catalog = create_catalog(config)
+    if catalog and not stopping.is_set():
+        books_added = 0
+        for query, series_url, series_info, state, error, books in crawl_queue.series_records():
+            if state == 'done':
+                books_added += catalog.upsert_series(series_url, series_info, [record for asin, idx, book_state, record, book_error in books])
+        print(f"Added {books_added} books to the catalog.")
+        catalog.close()
+    crawl_queue.close()
+
+class CrawlJob(object):
+    # One query submitted to the crawl service
+    def __init__(self, job_id, query):
+        self.id = job_id
+        self.query = query
+        self.status = 'queued'
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.completed_books = 0
+        self.total_books = 0
+        self.series_url = None
+        self.series_info = None
+        self.books_info_list = None
+        self.error = None
+        self.finished = threading.Event()
+
+    def summary(self):
+        return {
+            'id': self.id,
+            'query': self.query,
+            'status': self.status,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'progress': {'completed': self.completed_books, 'total': self.total_books},
+            'series_url': self.series_url,
+            'series_title': self.series_info.title if self.series_info else None,
+            'books': sum(1 for book_info in self.books_info_list or [] if book_info),
+            'error': self.error
+        }
+
+class CrawlService(object):
+    # Runs queries submitted through the JSON API on one crawl engine that
+    # stays up between them, so its connections, response cache, book store,
+    # title index and compiled export template are warm for every query and
+    # all callers share one request rate limit
+    def __init__(self, config, engine_name=None):
+        self.config = config
+        self.engine = create_crawl_engine(config, engine_name)
+        self.catalog = create_catalog(config)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, int(config.get("batch_concurrency", 4))))
+        self.max_jobs = max(1, int(config.get("service_job_history", 1000)))
+        self.lock = threading.Lock()
+        self.jobs = {}
+        # Unfinished jobs by query, so a query sent twice is crawled once
+        self.active_jobs = {}
+        self.last_job_id = 0
+        self.running = True
+        get_export_template()
+
+    def submit(self, query):
+        # Returns (job, created); a query that is already queued or running
+        # returns that job
+        with self.lock:
+            job = self.active_jobs.get(query)
+            if job is not None:
+                return job, False
+            self.last_job_id += 1
+            job = CrawlJob(str(self.last_job_id), query)
+            self.jobs[job.id] = job
+            self.active_jobs[query] = job
+            self.forget_old_jobs()
+        metrics.count('service_jobs', status='submitted')
+        self.executor.submit(self.run_job, job)
+        return job, True
+
+    def forget_old_jobs(self):
+        # Finished jobs beyond service_job_history are dropped, oldest first
+        finished_jobs = [job_id for job_id, job in self.jobs.items() if job.finished.is_set()]
+        for job_id in finished_jobs[:max(0, len(self.jobs) - self.max_jobs)]:
+            del self.jobs[job_id]
+
+    def run_job(self, job):
+        def show_progress(completed_books, total_books):
+            job.completed_books, job.total_books = completed_books, total_books
+
+        job.status = 'running'
+        job.started_at = time.time()
+        print(f"Job {job.id}: {job.query}")
+        try:
+            series_url, series_info, books_info_list, error = crawl_query_records(
+                self.engine, self.config, job.query, self.catalog, lambda: self.running, show_progress)
+            job.series_url, job.series_info, job.books_info_list, job.error = series_url, series_info, books_info_list, error
+            job.status = 'failed' if error else 'done'
+        except Exception as e:
+            job.error = repr(e)
+            job.status = 'failed'
+        job.finished_at = time.time()
+        with self.lock:
+            self.active_jobs.pop(job.query, None)
+        job.finished.set()
+        metrics.count('service_jobs', status=job.status)
+        print(f"Job {job.id} {job.status} in {job.finished_at - job.started_at:.1f}s ({job.summary()['books']} books).")
+
+    def job(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def job_list(self):
+        with self.lock:
+            return [job.summary() for job in self.jobs.values()]
+
+    def results(self, job):
+        # The same lines batch mode writes, plus the series itself
+        return {
+            'id': job.id,
+            'series': job.series_info.to_dict() if job.series_url else None,
+            'results': query_result_lines(job.query, job.series_url, job.series_info, job.books_info_list, job.error)
+        }
+
+    def render_html(self, job):
+        return ''.join(render_export(job.series_info, job.books_info_list, self.config.get("baseurl", ""),
+                                     single_book=job.series_url is None))
+
+    def close(self):
+        self.running = False
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.engine.print_stats()
+        self.engine.close()
+        if self.catalog:
+            self.catalog.close()
+
+class CrawlServiceHandler(BaseHTTPRequestHandler):
+    # POST /jobs {"query": ...}      submit a query, a series URL or a book URL
+    # GET  /jobs                     every job and its status
+    # GET  /jobs/ID                  one job's status; ?wait=SECONDS waits for it to finish
+    # GET  /jobs/ID/results          the books as JSON, in series order
+    # GET  /jobs/ID/html             the export page
+    # GET  /metrics                  run metrics in Prometheus text format
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, data):
+        self.send_body(status, json.dumps(data, ensure_ascii=False, default=record_to_json), 'application/json; charset=utf-8')
+
+    def send_error_json(self, status, message):
+        self.send_json(status, {'error': message})
+
+    def do_POST(self):
+        if urllib.parse.urlparse(self.path).path.rstrip('/') != '/jobs':
+            return self.send_error_json(404, "Not found.")
+        try:
+            data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except (ValueError, UnicodeDecodeError):
+            return self.send_error_json(400, "The body must be JSON.")
+        query = data.get('query') or data.get('url') if isinstance(data, dict) else None
+        if not isinstance(query, str) or not query.strip():
+            return self.send_error_json(400, "Send a JSON object with a \"query\" field.")
+        job, created = self.server.service.submit(query.strip())
+        self.send_json(202 if created else 200, job.summary())
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        service = self.server.service
+        if parts == ['jobs']:
+            return self.send_json(200, {'jobs': service.job_list()})
+        if parts == ['metrics']:
+            return self.send_body(200, metrics.prometheus_text(), 'text/plain; version=0.0.4; charset=utf-8')
+        if len(parts) not in (2, 3) or parts[0] != 'jobs' or (len(parts) == 3 and parts[2] not in ('results', 'html')):
+            return self.send_error_json(404, "Not found.")
+        job = service.job(parts[1])
+        if job is None:
+            return self.send_error_json(404, f"No job {parts[1]}.")
+        try:
+            wait = float(urllib.parse.parse_qs(url.query).get('wait', ['0'])[0])
+        except ValueError:
+            return self.send_error_json(400, "wait must be a number of seconds.")
+        job.finished.wait(min(max(wait, 0), 60))
+        if len(parts) == 2:
+            return self.send_json(200, job.summary())
+        # Results of a failed job are its error lines; it has no page
+        if not job.finished.is_set() or (parts[2] == 'html' and job.status != 'done'):
+            return self.send_json(409, job.summary())
+        if parts[2] == 'results':
+            return self.send_json(200, service.results(job))
+        self.send_body(200, service.render_html(job), 'text/html; charset=utf-8')
+
+class CrawlServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        super().__init__(address, CrawlServiceHandler)
+        self.service = service
+
+def run_service(engine_name=None, port=None):
+    # Daemon mode: keep one warm crawler and take queries over a local JSON API
+    config = load_config()
+    host = config.get("service_host", "127.0.0.1")
+    port = int(config.get("service_port", 8765)) if port is None else port
+    service = CrawlService(config, engine_name)
+    server = CrawlServiceServer((host, port), service)
+    print(f"Crawl service listening on http://{host}:{server.server_address[1]}/ (POST /jobs with {{\"query\": ...}}). Press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping the crawl service...")
+    finally:
+        server.server_close()
+        service.close()
+        write_run_metrics(config)
+
+def start_gui(engine_name=None):
+    from tkinter import Tk, Label, Entry, Button, StringVar, Text, Scrollbar, RIGHT, Y, BOTH, Frame, ttk, X
+    from tkinter import messagebox
 
-def start_gui():
     root = Tk()
     root.title("Series Info Collector")
     root.geometry("800x600")  # Increased default size
@@ -711,6 +4295,9 @@ def start_gui():
     progress_bar = ttk.Progressbar(root, orient='horizontal', mode='determinate')
     progress_bar.pack(fill=X, padx=10, pady=10)
 
+    # Redirect stdout of the crawl thread to the log_text widget
+    redirect_text = RedirectText(log_text, max(1, int(load_config().get("gui_log_lines", 5000))))
+
     def on_submit():
         if not hasattr(on_submit, "thread") or not on_submit.thread.is_alive():
             search_input = input_var.get()
@@ -719,17 +4306,15 @@ def start_gui():
                 return
 
             # Clear previous logs
-            log_text.delete(1.0, END)
-
-            # Redirect stdout to the log_text widget
-            redirect_text = RedirectText(log_text)
+            redirect_text.clear()
+            progress_bar['value'] = 0
 
             # Change button text to "Stop"
             submit_button.config(text="Stop")
             submit_button.running = True
 
             # Run the application in a separate thread to avoid freezing the GUI
-            on_submit.thread = threading.Thread(target=run_application, args=(search_input, log_text, progress_bar, submit_button, redirect_text), daemon=True)
+            on_submit.thread = threading.Thread(target=run_application, args=(search_input, log_text, progress_bar, submit_button, redirect_text, engine_name), daemon=True)
             on_submit.thread.start()
         else:
             # Stop the running process
@@ -744,4 +4329,31 @@ def start_gui():
     root.mainloop()
 
 if __name__ == "__main__":
-    start_gui()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Series Info Collector")
+    parser.add_argument('--engine', choices=['sync', 'async'], help="crawl engine to use (overrides 'engine' in config.json)")
+    parser.add_argument('--batch', metavar='QUERIES.jsonl', help="crawl every query in a JSONL file without opening the GUI")
+    parser.add_argument('--output', metavar='RESULTS.jsonl', default='output/results.jsonl', help="where --batch writes one JSON line per book")
+    parser.add_argument('--concurrency', type=int, help="queries crawled at the same time with --batch (overrides 'batch_concurrency')")
+    parser.add_argument('--queue', metavar='QUEUE.sqlite', help="work through a resumable job queue; with --batch, add its queries to the queue first")
+    parser.add_argument('--serve', action='store_true', help="run as a local crawl service with a JSON API instead of opening the GUI")
+    parser.add_argument('--port', type=int, help="port for --serve (overrides 'service_port')")
+    parser.add_argument('--find', nargs=2, metavar=('FIELD', 'VALUE'),
+                        help="look up books in the catalog by asin, author, illustrator, series or published (e.g. 2023-01..2023-06)")
+    args = parser.parse_args()
+    if args.find:
+        if args.find[0] not in ('asin', 'author', 'illustrator', 'series', 'published'):
+            parser.error("--find FIELD must be one of asin, author, illustrator, series, published")
+        run_catalog_query(*args.find)
+        sys.exit()
+    if args.batch or args.queue:
+        output_dir = os.path.dirname(args.output)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+    if args.serve:
+        run_service(engine_name=args.engine, port=args.port)
+    elif args.queue:
+        run_queue_worker(args.queue, engine_name=args.engine, input_path=args.batch, output_path=args.output)
+    elif args.batch:
+        run_batch(args.batch, args.output, engine_name=args.engine, concurrency=args.concurrency)
+    else:
+        start_gui(engine_name=args.engine)
\ No newline at end of file